@@ -0,0 +1,48 @@
+"""
+Client side of `entangled serve`. Commands that can be run by the server are
+sent over a Unix domain socket in the `.entangled` directory. This module
+only uses the standard library, so that a forwarded command doesn't pay for
+importing the rest of Entangled.
+"""
+
+import json
+import os
+import socket
+import sys
+
+
+SOCKET_PATH = os.path.join(".entangled", "server.sock")
+FORWARDED_COMMANDS = {"tangle", "stitch", "sync", "status"}
+
+
+def forward(argv: list[str]) -> int | None:
+    """
+    Run a command on the server, if one is running in the current directory.
+    Output of the command is written to stdout.
+
+    Returns the exit code of the command, or `None` if the command should
+    be run locally.
+    """
+    if not argv or argv[0] not in FORWARDED_COMMANDS:
+        return None
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(SOCKET_PATH):
+        return None
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(SOCKET_PATH)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # the server stopped without cleaning up
+            return None
+        s.sendall(json.dumps({"argv": argv}).encode() + b"\n")
+        with s.makefile("r", encoding="utf-8") as f:
+            for line in f:
+                msg = json.loads(line)
+                if "output" in msg:
+                    _ = sys.stdout.write(msg["output"])
+                    _ = sys.stdout.flush()
+                if "exit" in msg:
+                    return msg["exit"]
+
+    print("error: connection to the Entangled server was lost", file=sys.stderr)
+    return 1
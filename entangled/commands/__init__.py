@@ -1,13 +1,8 @@
-from .main import main
-from .stitch import stitch
-from .tangle import tangle
-from .new import new
-from .reset import reset
-from .sync import sync
-from .watch import watch
-from .status import status
-from .brei import brei
+"""
+The command line interface. Subcommands are defined in the modules of this
+package, which are only imported when the subcommand is run, see `LazyGroup`.
+"""
 
-__all__ = [
-    "main", "stitch", "tangle", "new", "reset", "sync", "watch", "status", "brei"
-]
+from .main import main, LazyGroup
+
+__all__ = ["main", "LazyGroup"]
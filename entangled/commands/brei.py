@@ -6,11 +6,13 @@ import textwrap
 
 from ..config import Config, read_config
 from ..io import FileCache
-from brei import resolve_tasks, Phony
+from ..errors.user import HelpfulUserError
+from brei import resolve_tasks, Phony, Program
 from ..logging import logger
 from .main import main
 
 import click
+import msgspec
 
 log = logger()
 
@@ -20,7 +22,11 @@ async def brei_main(target_strs: list[str], force_run: bool, throttle: int | Non
         Path(".entangled").mkdir()
 
     cfg = Config() | read_config(FileCache())
-    db = await resolve_tasks(cfg.brei, Path(".entangled/brei_history"))
+    try:
+        program = msgspec.convert(cfg.brei, Program)
+    except msgspec.ValidationError as e:
+        raise HelpfulUserError(f"unable to read brei config: {e}")
+    db = await resolve_tasks(program, Path(".entangled/brei_history"))
     if throttle:
         db.throttle = asyncio.Semaphore(throttle)
     db.force_run = force_run
@@ -1,11 +1,43 @@
 from ..logging import configure, logger
 from ..version import __version__
 
+from importlib import import_module
+from typing import Any, override
+
 import sys
 import rich_click as click
 
 
+class LazyGroup(click.RichGroup):
+    """
+    A command group that imports the modules of its subcommands only when
+    they are needed. Each module registers its command on import, using
+    `main.command()`.
+
+    Attributes:
+        lazy_commands: maps command names to the module defining them.
+    """
+    def __init__(self, *args: Any, lazy_commands: dict[str, str] | None = None, **kwargs: Any):  # pyright: ignore[reportExplicitAny, reportAny]
+        super().__init__(*args, **kwargs)
+        self.lazy_commands: dict[str, str] = lazy_commands or {}
+
+    @override
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    @override
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            _ = import_module(self.lazy_commands[cmd_name], __package__)
+        return super().get_command(ctx, cmd_name)
+
+
 @click.group(
+    cls=LazyGroup,
+    lazy_commands={
+        name: f".{name}" for name in
+        ["brei", "new", "reset", "serve", "status", "stitch", "sync", "tangle", "watch"]
+    },
     invoke_without_command=True,
     epilog="See https://entangled.github.io/ for more help and tutorials."
 )
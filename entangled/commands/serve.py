@@ -0,0 +1,123 @@
+from contextlib import redirect_stderr, redirect_stdout
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import traceback
+
+import rich_click as click
+
+from ..client import FORWARDED_COMMANDS, SOCKET_PATH
+from ..errors.internal import bug_contact
+from ..errors.user import HelpfulUserError, UserError
+from ..logging import logger
+
+from .main import main
+from .sync import ResidentDocument
+
+
+log = logger()
+
+
+@dataclass
+class Server:
+    """
+    Runs Entangled commands on behalf of `entangled.client`, keeping the
+    interpreter warm between commands. Only the commands in
+    `FORWARDED_COMMANDS` are accepted. Without options, `tangle`, `stitch`
+    and `sync` use a `ResidentDocument`, so that only changed markup files
+    are read again; with options they are run as usual.
+    """
+    resident: ResidentDocument = field(default_factory=ResidentDocument)
+
+    def run(self, argv: list[str]) -> tuple[str, int]:
+        """Run a command, returning its output and exit code."""
+        if not argv or argv[0] not in FORWARDED_COMMANDS:
+            return f"error: the Entangled server doesn't run `{' '.join(argv)}`\n", 2
+
+        output = io.StringIO()
+        code = 0
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                self._run(argv)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except Exception:
+                code = 1
+        return output.getvalue(), code
+
+    def _run(self, argv: list[str]):
+        """Run a command, handling errors like `entangled.main.cli` does."""
+        try:
+            match argv:
+                case ["sync"]:
+                    _ = self.resident.sync(pipelined=False)
+                case ["tangle"]:
+                    _ = self.resident.tangle()
+                case ["stitch"]:
+                    _ = self.resident.stitch()
+                case _:
+                    main.main(args=argv, prog_name="entangled", standalone_mode=False)
+        except click.ClickException as e:
+            print(f"Error: {e.format_message()}")
+            sys.exit(e.exit_code)
+        except HelpfulUserError as e:
+            e.handle()
+        except UserError as e:
+            log.error(e, exc_info=False)
+        except Exception as e:
+            log.error(str(e))
+            bug_contact(e)
+            traceback.print_exc()
+            raise
+
+    def handler(self) -> type[socketserver.StreamRequestHandler]:
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                request = json.loads(self.rfile.readline())
+                log.debug("request: %s", request)
+                output, code = server.run(request["argv"])
+                self.wfile.write(json.dumps({"output": output, "exit": code}).encode() + b"\n")
+
+        return Handler
+
+    def bind(self) -> socketserver.UnixStreamServer:
+        path = Path(SOCKET_PATH)
+        if path.exists():
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                try:
+                    s.connect(SOCKET_PATH)
+                except ConnectionRefusedError:
+                    path.unlink()
+                else:
+                    raise HelpfulUserError(f"a server is already running on `{SOCKET_PATH}`")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Only the owner may connect to the socket.
+        umask = os.umask(0o177)
+        try:
+            return socketserver.UnixStreamServer(SOCKET_PATH, self.handler())
+        finally:
+            _ = os.umask(umask)
+
+
+@main.command()
+def serve():
+    """Keep Entangled running in the background. The `tangle`, `stitch`,
+    `sync` and `status` commands are forwarded to it."""
+    if not hasattr(socket, "AF_UNIX"):
+        raise HelpfulUserError("`entangled serve` needs Unix domain sockets")
+
+    server = Server()
+    with server.bind() as s:
+        log.info("Serving on `%s`", SOCKET_PATH)
+        try:
+            s.serve_forever()
+        finally:
+            Path(SOCKET_PATH).unlink(missing_ok=True)
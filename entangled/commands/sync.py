@@ -1,7 +1,18 @@
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
 from enum import Enum
+from threading import Event, Lock
+from pathlib import Path
 
-from ..io import filedb, FileCache, transaction
-from ..interface import Document
+from ..config import ConfigUpdate
+from ..io import filedb, FileCache, Transaction, TransactionCancelled, transaction
+from ..io.filedb import FileDB
+from ..io.transaction import Action as FileAction
+from ..interface import Context, Document
+from ..iterators import numbered_lines
+from ..model.reference_name import clear_namespaces
+from ..readers import code
+from ..text_location import clear_filenames
 from ..errors.user import UserError
 
 from .main import main
@@ -13,6 +24,7 @@ class Action(Enum):
     NOTHING = 0
     TANGLE = 1
     STITCH = 2
+    MERGE = 3
 
 
 def sync_action(doc: Document) -> Action:
@@ -33,48 +45,277 @@ def sync_action(doc: Document) -> Action:
         if changed.issubset(db.managed_files):
             return Action.STITCH
 
+        if (conflicts := block_conflicts(doc, db, changed)) is not None and not conflicts:
+            return Action.MERGE
+
         logging.error("changed: %s", [str(p) for p in changed])
+        if conflicts:
+            logging.error("changed on both sides: %s", conflicts)
         logging.error(
             "Both markdown and code seem to have changed, don't know what to do now."
         )
         return Action.NOTHING
 
 
-def tangle(doc: Document):
-    with transaction() as t:
-        doc.load(t)
+def block_conflicts(doc: Document, db: FileDB, changed: set[Path]) -> list[str] | None:
+    """
+    Find code blocks that were changed differently in the markup and in the
+    code, comparing their source digests against the `blocks` index in the
+    filedb. Returns `None` if the filedb has no index to compare with.
+    """
+    if not db.blocks:
+        return None
+
+    markup = Document(context=Context(fs=doc.context.fs))
+    markup.load(Transaction(db, doc.context.fs))
+    markup_digests = markup.block_digests()
+
+    conflicts: list[str] = []
+    for path in sorted(changed & db.managed_files):
+        if path not in doc.context.fs:
+            continue
+        for block in code(numbered_lines(path, doc.context.fs[path].content)):
+            key = block.reference_id.key
+            digest = block.reference_id.source_digest(block.content)
+            if digest == db.blocks.get(key) or digest == markup_digests.get(key):
+                continue
+            if markup_digests.get(key) != db.blocks.get(key):
+                conflicts.append(key)
+    return conflicts
+
+
+type Loader = Callable[[Document, Transaction], ConfigUpdate | None]
+
+
+def tangle(doc: Document, pipelined: bool = False, load: Loader = Document.load,
+           cancel: Event | None = None, committed: list[FileAction] | None = None):
+    """Tangle the document. See `transaction` for `cancel` and `committed`."""
+    with transaction(pipelined=pipelined, cancel=cancel, committed=committed) as t:
+        load(doc, t)
         doc.tangle(t)
         t.clear_orphans()
         for h in doc.context.all_hooks:
             h.post_tangle(doc.reference_map)
 
 
-def stitch(doc: Document):
-    with transaction() as t:
-        doc.load(t)
+def stitch(doc: Document, pipelined: bool = False, merge: bool = False, load: Loader = Document.load,
+           cancel: Event | None = None, committed: list[FileAction] | None = None):
+    """Stitch the document, then tangle it again. See `transaction` for
+    `cancel` and `committed`."""
+    with transaction(pipelined=pipelined, cancel=cancel, committed=committed) as t:
+        if merge:
+            # The changes in the markup are kept, so they become the base
+            # for writing back changes from the code.
+            for path in doc.input_files():
+                t.db.update(t.fs, path)
+        load(doc, t)
         doc.load_all_code(t)
         doc.stitch(t)
-    with transaction() as t:
+    with transaction(pipelined=pipelined, cancel=cancel, committed=committed) as t:
         doc.tangle(t)
         for h in doc.context.all_hooks:
             h.post_tangle(doc.reference_map)
 
 
-def run_sync():
+def run_sync(pipelined: bool = False):
+    """Tangle or stitch, depending on which files changed. With `pipelined`
+    set, each file is written as soon as it is ready."""
     doc = Document()
     match sync_action(doc):
         case Action.TANGLE:
             logging.info("Tangling.")
-            tangle(doc)
+            tangle(doc, pipelined)
 
         case Action.STITCH:
             logging.info("Stitching.")
-            stitch(doc)
+            stitch(doc, pipelined)
+
+        case Action.MERGE:
+            logging.info("Merging changes in markup and code.")
+            stitch(doc, pipelined, merge=True)
 
         case Action.NOTHING:
             pass
 
 
+CONFIG_FILES = [Path("./entangled.toml"), Path("./pyproject.toml")]
+
+
+class CommittedActions(list[FileAction]):
+    """
+    The file actions run by a sync. A sync in a worker thread appends to
+    this list while it may be read from another thread, so appending and
+    reading go through a lock; use `snapshot` to read.
+    """
+    def __init__(self):
+        super().__init__()
+        self._lock = Lock()
+
+    def append(self, action: FileAction):
+        with self._lock:
+            super().append(action)
+
+    def extend(self, actions: Iterable[FileAction]):
+        with self._lock:
+            super().extend(actions)
+
+    def snapshot(self) -> list[FileAction]:
+        with self._lock:
+            return list(self)
+
+
+class ConfigChanged(Exception):
+    pass
+
+
+@dataclass
+class ResidentDocument:
+    """
+    Keeps a `Document` in memory between syncs, for use in watch mode and
+    by `entangled serve`.
+    Before each sync, only markup files that changed since they were last
+    read are parsed again, replacing their code blocks in the reference map.
+    Tangling and stitching are incremental with respect to the filedb, so
+    only affected targets are written.
+
+    The document is read from scratch when the configuration changes, when
+    a sync fails, or when a hook is enabled that can't be updated one file
+    at a time.
+
+    The file actions run by the last sync are kept in `committed`, which
+    is updated while the sync is running, see `CommittedActions`.
+    """
+    fs: FileCache = field(default_factory=FileCache)
+    doc: Document | None = None
+    loaded: dict[Path, str] = field(default_factory=dict)
+    header: ConfigUpdate | None = None
+    config_digests: dict[Path, str | None] = field(default_factory=dict)
+    committed: CommittedActions = field(default_factory=CommittedActions)
+
+    def _config_digests(self) -> dict[Path, str | None]:
+        return {p: self.fs.stat(p).hexdigest if p in self.fs else None for p in CONFIG_FILES}
+
+    def _document(self) -> Document:
+        if self.doc is not None and self.config_digests == self._config_digests() \
+                and all(h.incremental for h in self.doc.context.all_hooks):
+            self.doc.reset_hooks()
+            return self.doc
+
+        logging.debug("reading document from scratch")
+        self.doc = None
+        self.loaded = {}
+        clear_namespaces()
+        clear_filenames()
+        self.config_digests = self._config_digests()
+        return Document(context=Context(fs=self.fs), keep_sources=True)
+
+    def load(self, doc: Document, t: Transaction):
+        """Read all markup files that changed since they were last read."""
+        files = doc.input_files()
+        if not doc.content:
+            self.header = doc.load(t)
+            self.loaded = {p: self.fs.stat(p).hexdigest for p in files}
+            return
+
+        for p in set(self.loaded) - set(files):
+            logging.debug("forgetting `%s`", p)
+            doc.forget_source(p)
+            del self.loaded[p]
+
+        for p in files:
+            digest = self.fs.stat(p).hexdigest
+            if self.loaded.get(p) == digest:
+                continue
+            logging.debug("reading `%s`", p)
+            update = doc.reload_source(t, p)
+            # With a single input file, its header sets the configuration.
+            if len(files) == 1 and update != self.header:
+                raise ConfigChanged()
+            self.loaded[p] = digest
+
+    def sync(self, pipelined: bool = True, cancel: Event | None = None) -> bool:
+        """
+        Tangle or stitch, depending on which files changed. Once `cancel` is
+        set, no further changes are written. Returns `False` if the sync
+        was cancelled.
+        """
+        return self._run(lambda: self._sync(pipelined, cancel))
+
+    def tangle(self) -> bool:
+        """Tangle the document, like `entangled tangle`."""
+        return self._run(self._tangle)
+
+    def stitch(self) -> bool:
+        """Stitch code changes back into the document, like `entangled stitch`."""
+        return self._run(self._stitch)
+
+    def _run(self, step: Callable[[], None]) -> bool:
+        self.fs.reset()
+        self.committed = CommittedActions()
+        loaded = dict(self.loaded)
+        try:
+            step()
+        except ConfigChanged:
+            self.doc = None
+            return self._run(step)
+        except TransactionCancelled:
+            # Files that were read are not yet updated in the filedb, so
+            # they should be read again.
+            self.loaded = loaded
+            self._forget_written()
+            return False
+        except BaseException:
+            self.doc = None
+            raise
+        self._forget_written()
+        return True
+
+    def _forget_written(self):
+        """Markup files written by stitching no longer match what was read
+        from them, so they are read again in full on the next sync."""
+        for a in self.committed.snapshot():
+            if self.loaded.pop(a.target, None) is not None and self.doc is not None:
+                _ = self.doc.source_texts.pop(a.target, None)
+
+    def _sync(self, pipelined: bool, cancel: Event | None):
+        doc = self._document()
+        match sync_action(doc):
+            case Action.TANGLE:
+                logging.info("Tangling.")
+                tangle(doc, pipelined, self.load, cancel, self.committed)
+
+            case Action.STITCH:
+                logging.info("Stitching.")
+                stitch(doc, pipelined, load=self.load, cancel=cancel, committed=self.committed)
+
+            case Action.MERGE:
+                logging.info("Merging changes in markup and code.")
+                stitch(Document(context=Context(fs=self.fs)), pipelined, merge=True,
+                       cancel=cancel, committed=self.committed)
+                return
+
+            case Action.NOTHING:
+                pass
+
+        if doc.content:
+            self.doc = doc
+
+    def _tangle(self):
+        doc = self._document()
+        tangle(doc, load=self.load, committed=self.committed)
+        if doc.content:
+            self.doc = doc
+
+    def _stitch(self):
+        doc = self._document()
+        with transaction(committed=self.committed) as t:
+            self.load(doc, t)
+            doc.load_all_code(t)
+            doc.stitch(t)
+        if doc.content:
+            self.doc = doc
+
+
 @main.command()
 def sync():
     """Be smart wether to tangle or stich"""
@@ -13,7 +13,10 @@ from ..interface import Context, Document
               help="annotation method")
 @click.option("-f", "--force", is_flag=True, help="force overwriting existing files")
 @click.option("-s", "--show", is_flag=True, help="only show what would happen")
-def tangle(*, annotate: AnnotationMethod | None = None, force: bool = False, show: bool = False):
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1,
+              help="number of targets to tangle in parallel")
+def tangle(*, annotate: AnnotationMethod | None = None, force: bool = False, show: bool = False,
+           jobs: int = 1):
     if show:
         mode = TransactionMode.SHOW
     elif force:
@@ -21,14 +24,15 @@ def tangle(*, annotate: AnnotationMethod | None = None, force: bool = False, sho
     else:
         mode = TransactionMode.FAIL
 
-    do_tangle(annotate=annotate, mode=mode, skip_post_tangle=False)
+    do_tangle(annotate=annotate, mode=mode, skip_post_tangle=False, jobs=jobs)
 
 
 def do_tangle(*,
     annotate: AnnotationMethod | None = None,
     mode: TransactionMode = TransactionMode.FAIL,
     fs: AbstractFileCache | None = None,
-    skip_post_tangle: bool = True):
+    skip_post_tangle: bool = True,
+    jobs: int = 1):
     """Tangle codes from the documentation."""
 
     if fs is None:
@@ -38,7 +42,7 @@ def do_tangle(*,
 
     with transaction(mode, fs=fs) as t:
         doc.load(t)
-        doc.tangle(t, annotate)
+        doc.tangle(t, annotate, jobs)
         t.clear_orphans()
 
     if skip_post_tangle:
@@ -1,10 +1,21 @@
-from threading import Event
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from threading import Event, Lock
 from pathlib import Path
 
+import asyncio
+import os
+import time
+
+from ..config import Config, read_config
+from ..io import FileCache, filedb
+from ..io.filedb import FILEDB_PATH
+from ..io.stat import hexdigest
+from ..io.transaction import Action, WriterBase
 from ..status import find_watch_dirs
 from ..logging import logger
 
-from .sync import run_sync
+from .sync import CONFIG_FILES, ResidentDocument
 from .main import main
 from ..errors.user import UserError
 
@@ -14,35 +25,273 @@ import watchfiles
 log = logger()
 
 
-def watch_filter(change: watchfiles.Change, path: str) -> bool:
-    if Path(path).relative_to(Path.cwd()).as_posix().startswith(".entangled"):
-        return False
-    return True
+type FileChange = tuple[watchfiles.Change, str]
 
 
-def _watch(_stop_event: Event | None = None, _start_event: Event | None = None):
-    """Keep a loop running, watching for changes. This interface is separated
-    from the CLI one, so that it can be tested using threading instead of
-    subprocess."""
+def _mtime(path: Path) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
 
-    def stop() -> bool:
-        return _stop_event is not None and _stop_event.is_set()
 
-    log.debug("Running daemon")
-    run_sync()
+def _glob_root(pattern: str) -> tuple[Path, bool]:
+    """The directory that a glob pattern starts from, and whether the
+    pattern matches files in subdirectories of it."""
+    parts = Path(pattern).parts
+    n = 0
+    while n < len(parts) - 1 and not any(c in parts[n] for c in "*?["):
+        n += 1
+    return Path(*parts[:n]), len(parts) - n > 1
 
-    if _start_event is not None:
-        log.debug("Setting start event")
-        _start_event.set()
 
-    dirs = "."  # find_watch_dirs()
+@dataclass
+class WatchFilter:
+    """
+    Selects the file system events that are relevant to the daemon: changes
+    to input files, as given by `watch_list` and `ignore_list`, to targets
+    managed in the filedb, and to the configuration files. Call `refresh`
+    after a sync, to recompute the filter when the configuration or the
+    filedb changed.
+
+    Where a pattern in the `watch_list` reaches into subdirectories, as
+    with `**`, the directory it starts from is watched recursively; these
+    are the `roots`. Other directories that need watching, in `dirs`, are
+    watched on their own: those that patterns start from, those containing
+    input files and targets (see `find_watch_dirs`), and their parents, so
+    that new directories are noticed. Directories that are created are
+    watched as well, since input files may appear in them.
+    """
+    root: Path = field(default_factory=Path.cwd)
+    watch_list: list[str] = field(default_factory=list)
+    ignore_list: list[str] = field(default_factory=list)
+    targets: set[Path] = field(default_factory=set)
+    roots: set[Path] = field(default_factory=set)
+    dirs: set[Path] = field(default_factory=set)
+    created: set[Path] = field(default_factory=set)
+    _key: tuple[object, ...] | None = None
+
+    def refresh(self) -> bool:
+        """Recompute the filter if needed. Returns whether it changed."""
+        for d in list(self.created):
+            if not d.is_dir():
+                self.created.discard(d)
+        created = frozenset(list(self.created))
+        key = (*(_mtime(p) for p in [*CONFIG_FILES, FILEDB_PATH]), created)
+        if key == self._key:
+            return False
 
-    for changes in watchfiles.watch(dirs, stop_event=_stop_event, watch_filter=watch_filter):
-        log.debug(changes)
+        fs = FileCache()
+        cfg = Config() | read_config(fs)
+        with filedb(readonly=True, fs=fs) as db:
+            targets = db.managed_files
+        roots: set[Path] = set()
+        dirs = {Path(".")}
+        for pattern in cfg.watch_list:
+            d, recursive = _glob_root(pattern)
+            if recursive:
+                roots.add(d)
+            dirs.add(d)
+        for d in find_watch_dirs(fs) | created:
+            dirs.add(d)
+        for d in list(dirs):
+            dirs.update(d.parents)
+        dirs = {d for d in dirs if not any(r == d or r in d.parents for r in roots)}
+        changed = (cfg.watch_list, cfg.ignore_list, targets, roots, dirs) \
+            != (self.watch_list, self.ignore_list, self.targets, self.roots, self.dirs)
+        self.watch_list, self.ignore_list, self.targets = cfg.watch_list, cfg.ignore_list, targets
+        self.roots, self.dirs = roots, dirs
+        self._key = key
+        return changed
+
+    def relevant(self, path: Path) -> bool:
+        if path.parts[:1] == (".entangled",):
+            return False
+        if path in self.targets or path in CONFIG_FILES:
+            return True
+        return any(path.full_match(pat) for pat in self.watch_list) \
+            and not any(path.match(pat) for pat in self.ignore_list)
+
+    def __call__(self, change: watchfiles.Change, path: str) -> bool:
         try:
-            run_sync()
+            rel = Path(path).relative_to(self.root)
+        except ValueError:
+            return False
+        if change == watchfiles.Change.added and rel.parts[:1] != (".entangled",) \
+                and os.path.isdir(path):
+            self.created.add(rel)
+            return True
+        return self.relevant(rel)
+
+
+@dataclass
+class SelfWrites:
+    """
+    Files that the daemon wrote itself, with their digests, so that the
+    events caused by these writes can be ignored. An event is only ignored
+    if the file on disk still has the digest that was written (`None` for a
+    deleted file); entries expire after `ttl` seconds.
+
+    Writes are recorded from the sync thread and looked up from the event
+    loop, so the entries are guarded by a lock.
+    """
+    root: Path = field(default_factory=Path.cwd)
+    ttl: float = 5.0
+    _entries: dict[Path, tuple[str | None, float]] = field(default_factory=dict)
+    _lock: Lock = field(default_factory=Lock)
+
+    def record(self, actions: Iterable[Action]):
+        expires = time.monotonic() + self.ttl
+        entries = {a.target: (a.content_digest if isinstance(a, WriterBase) else None, expires)
+                   for a in actions}
+        with self._lock:
+            self._entries.update(entries)
+
+    def is_own(self, path: str) -> bool:
+        """Whether the file at `path` is as the daemon left it."""
+        try:
+            key = Path(path).relative_to(self.root)
+        except ValueError:
+            return False
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                return False
+            digest, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False
+        try:
+            with open(key, "r", encoding="utf-8") as f:
+                return hexdigest(f.read()) == digest
+        except FileNotFoundError:
+            return digest is None
+        except (OSError, UnicodeDecodeError):
+            return False
+
+    def filter(self, changes: set[FileChange]) -> set[FileChange]:
+        """Remove the changes that were caused by the daemon itself."""
+        return {(c, p) for c, p in changes if not self.is_own(p)}
+
+
+@dataclass
+class SyncScheduler:
+    """
+    Runs syncs in a worker thread, one at a time. A sync starts once no new
+    changes came in for `delay` seconds. Changes that come in while a sync
+    is running cancel that sync, as far as it didn't write its changes yet,
+    and are coalesced into a single follow-up sync.
+
+    When the set of directories to watch changes, `restart` is set.
+    """
+    resident: ResidentDocument
+    self_writes: SelfWrites
+    watch_filter: WatchFilter
+    delay: float = 0.05
+    restart: Event = field(default_factory=Event)
+    _requested: asyncio.Event = field(default_factory=asyncio.Event)
+    _cancel: Event = field(default_factory=Event)
+
+    def request(self):
+        self._cancel.set()
+        self._requested.set()
+
+    def changed(self, changes: set[FileChange]):
+        """Request a sync, unless all changes were caused by our own writes."""
+        self.self_writes.record(self.resident.committed.snapshot())
+        if not self.self_writes.filter(changes):
+            log.debug("only our own writes changed")
+            return
+        self.request()
+
+    async def run(self):
+        while True:
+            await self._requested.wait()
+            while self._requested.is_set():
+                self._requested.clear()
+                try:
+                    await asyncio.wait_for(self._requested.wait(), self.delay)
+                except TimeoutError:
+                    pass
+            self._cancel.clear()
+            await asyncio.to_thread(self.sync)
+
+    def sync(self):
+        """Run a sync, then update the filter and the directories to watch."""
+        try:
+            if not self.resident.sync(cancel=self._cancel):
+                log.info("Sync cancelled, files changed.")
         except UserError as e:
-            logger().error(e, exc_info=False)
+            log.error(e, exc_info=False)
+        self.self_writes.record(self.resident.committed.snapshot())
+        watched = (self.watch_filter.roots, self.watch_filter.dirs)
+        if self.watch_filter.refresh():
+            log.debug("watching %s, ignoring %s and %d targets",
+                      self.watch_filter.watch_list, self.watch_filter.ignore_list,
+                      len(self.watch_filter.targets))
+            if (self.watch_filter.roots, self.watch_filter.dirs) != watched:
+                self.restart.set()
+
+
+@dataclass
+class WatchStop:
+    """Stops watching when either `stop` or `restart` is set. Setting this
+    event only sets `restart`."""
+    stop: Event | None
+    restart: Event
+
+    def is_set(self) -> bool:
+        return self.restart.is_set() or (self.stop is not None and self.stop.is_set())
+
+    def set(self):
+        self.restart.set()
+
+
+async def _awatch(stop_event: Event | None, start_event: Event | None):
+    resident = ResidentDocument()
+    resident.sync()
+    self_writes = SelfWrites()
+    self_writes.record(resident.committed.snapshot())
+    watch_filter = WatchFilter()
+    _ = watch_filter.refresh()
+    scheduler = SyncScheduler(resident, self_writes, watch_filter)
+
+    if start_event is not None:
+        log.debug("Setting start event")
+        start_event.set()
+
+    runner = asyncio.create_task(scheduler.run())
+
+    async def watch_dirs(dirs: set[Path], recursive: bool):
+        paths = sorted(d for d in dirs if d.is_dir())
+        if not paths:
+            return
+        async for changes in watchfiles.awatch(
+                *paths, stop_event=WatchStop(stop_event, scheduler.restart),
+                watch_filter=watch_filter, recursive=recursive):
+            log.debug(changes)
+            if runner.done():
+                runner.result()
+            scheduler.changed(changes)
+
+    try:
+        while stop_event is None or not stop_event.is_set():
+            # changes may have been missed while (re)starting the watch
+            scheduler.restart.clear()
+            scheduler.request()
+            log.debug("watching %d directories and %d directory trees",
+                      len(watch_filter.dirs), len(watch_filter.roots))
+            _ = await asyncio.gather(watch_dirs(watch_filter.dirs, False),
+                                     watch_dirs(watch_filter.roots, True))
+    finally:
+        _ = runner.cancel()
+
+
+def _watch(_stop_event: Event | None = None, _start_event: Event | None = None):
+    """Keep a loop running, watching for changes. This interface is separated
+    from the CLI one, so that it can be tested using threading instead of
+    subprocess."""
+    log.debug("Running daemon")
+    asyncio.run(_awatch(_stop_event, _start_event))
 
 
 @main.command()
@@ -9,8 +9,6 @@ from .annotation_method import AnnotationMethod
 from .namespace_default import NamespaceDefault
 from .config_update import ConfigUpdate, prefab_config
 
-from brei import Program
-
 
 @dataclass(frozen=True)
 class Config:
@@ -34,6 +32,7 @@ class Config:
             indicating markdown source locations.
         hooks: List of enabled hooks.
         hook: Sub-config of hooks.
+        brei: Brei program, converted when running `entangled brei`.
     """
     version: Version = Version((2, 0))
     languages: dict[str, Language] = field(default_factory=lambda: {
@@ -53,7 +52,7 @@ class Config:
 
     hooks: set[str] = field(default_factory=lambda: { "shebang" })
     hook: dict[str, object] = field(default_factory=dict)
-    brei: Program = field(default_factory=Program)
+    brei: dict[str, object] = field(default_factory=dict)
 
     def get_language(self, lang_id: str) -> Language | None:
         return self.languages.get(lang_id, None)
@@ -6,8 +6,6 @@ from .markers import Markers, default_markers, basic_markers
 from .annotation_method import AnnotationMethod
 from .namespace_default import NamespaceDefault
 
-from brei import Program
-
 
 class ConfigUpdate(Struct):
     """An update to existing config. This actually sets the API for all
@@ -27,6 +25,9 @@ class ConfigUpdate(Struct):
         hooks: additive, prepend a `~` character to disable a hook).
         hook: merged with `|` operator (overrides one deep).
         brei: overrides (TODO: implement merge, requires updating Brei).
+            Kept as raw data, so that reading the config doesn't import
+            Brei; a malformed section is only reported when running
+            `entangled brei`.
     """
     version: str
     style: DocumentStyle | None = None
@@ -43,7 +44,7 @@ class ConfigUpdate(Struct):
 
     hooks: list[str] = field(default_factory=list)
     hook: dict[str, object] | None = None
-    brei: Program | None = None
+    brei: dict[str, object] | None = None
 
 
 prefab_config: dict[DocumentStyle, ConfigUpdate] = {
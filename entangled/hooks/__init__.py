@@ -1,28 +1,68 @@
 import logging
-from importlib.metadata import entry_points
+from collections.abc import Iterator, Mapping
+from importlib import import_module
+from importlib.metadata import EntryPoint
+from typing import override
 
 from .base import HookBase, PrerequisitesFailed
-from . import build, task, quarto_attributes, shebang, spdx_license, repl
+from .discovery import discover_hooks
 from ..config import Config
 from typing import TypeVar
 import msgspec
 
 AbstractHook = TypeVar("AbstractHook", bound=HookBase)
 
-discovered_hooks = entry_points(group="entangled.hooks")
 
-external_hooks = {
-    name: discovered_hooks[name].load().Hook for name in discovered_hooks.names  # pyright: ignore[reportAny]
-}
+class HookRegistry(Mapping[str, type[HookBase]]):
+    """
+    Hook classes by name. The module defining a hook is only imported when
+    the hook is looked up. Hooks installed by other packages, in the
+    `entangled.hooks` entry-point group, are found through `discover_hooks`;
+    an installed hook takes precedence over a built-in hook by the same name.
+    """
+    def __init__(self, builtin: dict[str, str]):
+        self._builtin: dict[str, str] = builtin
+        self._external: dict[str, EntryPoint] | None = None
+        self._loaded: dict[str, type[HookBase]] = {}
 
-hooks: dict[str, type[HookBase]] = {
-    "build": build.Hook,
-    "brei": task.Hook,
-    "repl": repl.Hook,
-    "shebang": shebang.Hook,
-    "spdx_license": spdx_license.Hook,
-    "quarto_attributes": quarto_attributes.Hook,
-} | external_hooks
+    def external(self) -> dict[str, EntryPoint]:
+        if self._external is None:
+            self._external = discover_hooks()
+        return self._external
+
+    @override
+    def __getitem__(self, name: str) -> type[HookBase]:
+        if name not in self._loaded:
+            if name in self.external():
+                module = self.external()[name].load()
+            elif name in self._builtin:
+                module = import_module(self._builtin[name], __package__)
+            else:
+                raise KeyError(name)
+            self._loaded[name] = module.Hook  # pyright: ignore[reportAny]
+        return self._loaded[name]
+
+    @override
+    def __contains__(self, name: object) -> bool:
+        return name in self._builtin or name in self.external()
+
+    @override
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._builtin | self.external())
+
+    @override
+    def __len__(self) -> int:
+        return len(self._builtin | self.external())
+
+
+hooks = HookRegistry({
+    "build": ".build",
+    "brei": ".task",
+    "repl": ".repl",
+    "shebang": ".shebang",
+    "spdx_license": ".spdx_license",
+    "quarto_attributes": ".quarto_attributes",
+})
 
 
 def create_hook(cfg: Config, h: str, state: HookBase.State) -> HookBase | None:
@@ -16,6 +16,10 @@ class PrerequisitesFailed(Exception):
 
 
 class HookBase:
+    # Set to `False` if the hook state depends on all markup being read in a
+    # single pass, so that a document can't be updated one file at a time.
+    incremental: bool = True
+
     class Config(Struct):
         pass
 
@@ -16,8 +16,8 @@ import msgspec
 
 from ..config.language import Language
 from ..io import Transaction
-from ..model.properties import Property, get_attribute, get_attribute_string, get_classes
-from ..model import ReferenceId, ReferenceMap, CodeBlock
+from ..model.properties import get_attribute, get_attribute_string
+from ..model import ReferenceMap
 
 from .base import HookBase, PrerequisitesFailed
 
@@ -85,10 +85,9 @@ class Hook(HookBase):
     @override
     def pre_tangle(self, refs: ReferenceMap):
         """Add a CodeBlock's target attribute to the list of targets."""
-        for (ref, cb) in refs.items():
+        for ref in refs.by_class("build"):
             logging.debug("build hook: passing: %s", ref)
-            if "build" not in get_classes(cb.properties):
-                continue
+            cb = refs[ref]
             target = get_attribute_string(cb.properties, "target")
             if target is None:
                 continue
@@ -0,0 +1,97 @@
+"""
+Discovery of hooks installed by other packages, in the `entangled.hooks`
+entry-point group. Scanning the installed distributions is slow in large
+environments, so the result is cached in the user cache directory, one file
+for each environment. The cache is keyed by `sys.path` and the modification
+times of its entries, which change whenever distributions are installed or
+removed.
+"""
+
+from importlib.metadata import EntryPoint, distributions
+from pathlib import Path
+
+import hashlib
+import json
+import os
+import re
+import sys
+
+from ..logging import logger
+
+
+GROUP = "entangled.hooks"
+
+
+log = logger()
+
+
+def search_path() -> list[str]:
+    """The entries of `sys.path` that are searched for hooks. Relative
+    entries, such as the current directory, differ from one project to the
+    next and are left out."""
+    return [entry for entry in sys.path if os.path.isabs(entry)]
+
+
+def cache_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    environment = "\n".join([sys.prefix, *sys.path])
+    digest = hashlib.sha256(environment.encode()).hexdigest()[:16]
+    return Path(cache_home) / "entangled" / f"entry_points-{digest}.json"
+
+
+def environment_key() -> list[tuple[str, int | None]]:
+    """The entries of the search path with their modification times."""
+    def mtime(entry: str) -> int | None:
+        try:
+            return os.stat(entry).st_mtime_ns
+        except OSError:
+            return None
+
+    return [(entry, mtime(entry)) for entry in search_path()]
+
+
+def read_cache(path: Path, key: list[tuple[str, int | None]]) -> dict[str, str] | None:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if [tuple(k) for k in data["key"]] != key:
+            return None
+        return {str(name): str(value) for name, value in data["hooks"].items()}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def write_cache(path: Path, key: list[tuple[str, int | None]], hooks: dict[str, str]):
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _ = tmp.write_text(json.dumps({"key": key, "hooks": hooks}), encoding="utf-8")
+        _ = tmp.replace(path)
+    except OSError as e:
+        log.debug("could not write entry-point cache: %s", e)
+        tmp.unlink(missing_ok=True)
+
+
+def scan(path: list[str]) -> dict[str, str]:
+    """Find the entry points in `GROUP`, by name. Like `entry_points`, only
+    the first distribution of a given name on the path is used."""
+    seen: set[str] = set()
+    hooks: dict[str, str] = {}
+    for dist in distributions(path=path):
+        name = re.sub(r"[-_.]+", "_", dist.metadata["Name"] or "").lower()
+        if name in seen:
+            continue
+        seen.add(name)
+        for ep in dist.entry_points.select(group=GROUP):
+            _ = hooks.setdefault(ep.name, ep.value)
+    return hooks
+
+
+def discover_hooks() -> dict[str, EntryPoint]:
+    """Find hooks in the `entangled.hooks` entry-point group, by name."""
+    path = cache_path()
+    key = environment_key()
+    if (hooks := read_cache(path, key)) is None:
+        log.debug("scanning for hooks in entry points")
+        hooks = scan([entry for entry, _ in key])
+        write_cache(path, key, hooks)
+    return {name: EntryPoint(name, value, GROUP) for name, value in hooks.items()}
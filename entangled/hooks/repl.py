@@ -34,6 +34,9 @@ def strip_comments(code: str, language: Language) -> str:
 
 @final
 class Hook(HookBase):
+    # Sessions are collected in `on_read`, in order of all markup files.
+    incremental = False
+
     class Config(HookBase.Config):
         config: dict[str, ReplConfig] = msgspec.field(default_factory=dict)
 
@@ -9,7 +9,7 @@ from ..config import AnnotationMethod
 from ..io import Transaction
 
 from ..model import ReferenceId, ReferenceMap
-from ..model.properties import Class, get_attribute_string, get_classes, get_typed_attribute
+from ..model.properties import Class, get_attribute_string, get_typed_attribute
 from ..model.tangle import tangle_ref
 from .base import HookBase
 from ..logging import logger
@@ -63,10 +63,8 @@ class Hook(HookBase):
 
     @override
     def pre_tangle(self, refs: ReferenceMap):
-        for ref, cb in refs.items():
-            if "task" not in get_classes(cb.properties):
-                continue
-
+        for ref in refs.by_class("task"):
+            cb = refs[ref]
             self.sources.append(Path(ref.file))
 
             match cb.properties[0]:
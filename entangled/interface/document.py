@@ -1,14 +1,20 @@
 from dataclasses import dataclass, field
 from pathlib import PurePath, Path
 
+import hashlib
+
 from ..config import Config, ConfigUpdate, get_input_files, read_config, AnnotationMethod
-from ..model import ReferenceMap, tangle_ref, Content, content_to_text
+from ..model import ReferenceMap, ReferenceGraph, TangleCache, tangle_ref, tangle_stream, Content, SourceText, content_to_text
 from ..io import AbstractFileCache, FileCache, Transaction
+from ..io.filedb import FileDB
+from ..model.reference_name import ReferenceName
 from ..readers import code
 from ..iterators import numbered_lines, run_generator
 from ..logging import logger
 
 from .context import Context, markdown
+from .parallel import tangle_parallel
+from .reparse import reparse
 
 
 log = logger()
@@ -16,9 +22,18 @@ log = logger()
 
 @dataclass
 class Document:
+    """
+    The markup files of a project, with their code blocks.
+
+    The `source_texts` of markup files are needed to stitch and to read
+    changed files again. They are built when code is read back for stitching,
+    or right when a markup file is loaded if `keep_sources` is set.
+    """
     context: Context = field(default_factory=Context)
     reference_map: ReferenceMap = field(default_factory=ReferenceMap)
     content: dict[Path, list[Content]] = field(default_factory=dict)
+    source_texts: dict[Path, SourceText] = field(default_factory=dict)
+    keep_sources: bool = False
 
     @property
     def config(self):
@@ -49,59 +64,231 @@ class Document:
         ref_name = self.reference_map.select_by_target(path)
         return tangle_ref(self.reference_map, ref_name, self.config.annotation)
 
-    def write_target(self, t: Transaction, path: Path, annotation: AnnotationMethod | None = None):
+    def write_target(self, t: Transaction, path: Path, annotation: AnnotationMethod | None = None,
+                     cache: TangleCache | None = None, checked: bool = False):
         ref_name = self.reference_map.select_by_target(path)
         refs = self.reference_map.select_by_name(ref_name)
         main_block = self.reference_map[refs[0]]
         annotation = self.config.annotation if annotation is None else annotation
-        text, deps = tangle_ref(self.reference_map, ref_name, annotation)
-        t.write(path, text, map(Path, deps), main_block.mode)
+        chunks, deps = tangle_stream(self.reference_map, ref_name, annotation, cache, checked)
+        t.write_stream(path, chunks, deps, main_block.mode)
+
+    def source(self, t: Transaction, path: Path) -> SourceText:
+        """The `SourceText` of a loaded markup file, built on first use. This
+        should happen before any of its code blocks are changed."""
+        if (source := self.source_texts.get(path)) is None:
+            source = SourceText.from_content(self.reference_map, self.content[path])
+            source.verbatim = source.text == t.read(path)
+            self.source_texts[path] = source
+        return source
 
     def load_source(self, t: Transaction, path: Path) -> ConfigUpdate | None:
-        reader = markdown(self.context, self.reference_map, numbered_lines(path, t.read(path)))
+        text = t.read(path)
+        reader = markdown(self.context, self.reference_map, numbered_lines(path, text))
         content, update = run_generator(reader)
         log.debug("got config update: %s", update)
         self.content[path] = content
+        _ = self.source_texts.pop(path, None)
+        if self.keep_sources:
+            _ = self.source(t, path)
         t.update(path)
         return update
 
+    def reload_source(self, t: Transaction, path: Path) -> ConfigUpdate | None:
+        """
+        Read a markup file again, replacing the code blocks that were loaded
+        from it earlier. If possible, only the part of the file that changed
+        is parsed, see `reparse`. Otherwise the file is parsed into a
+        separate reference map first, so that a parse error leaves the
+        document as it was.
+        """
+        text = t.read(path)
+        if (source := self.source_texts.get(path)) is not None and \
+                (r := reparse(self.context, self.reference_map, path, self.content[path], source, text)):
+            log.debug("read changes in `%s`", path)
+            self.reference_map.replace_file(path, r.blocks)
+            self.content[path] = r.content
+            self.source_texts[path] = r.source
+            t.update(path)
+            return r.update
+
+        scratch = ReferenceMap()
+        reader = markdown(self.context, scratch, numbered_lines(path, text))
+        content, update = run_generator(reader)
+        self.reference_map.replace_file(path, scratch.items())
+        self.content[path] = content
+        _ = self.source_texts.pop(path, None)
+        if self.keep_sources:
+            _ = self.source(t, path)
+        t.update(path)
+        return update
+
+    def forget_source(self, path: Path):
+        """Remove a markup file and all of its code blocks from the document."""
+        _ = self.reference_map.remove_file(path)
+        _ = self.content.pop(path, None)
+        _ = self.source_texts.pop(path, None)
+
+    def reset_hooks(self):
+        """Start with fresh hook states, keeping the current configuration."""
+        self.context = Context(self.context.fs, self.context.config)
+
     def load_code(self, t: Transaction, path: Path):
+        """
+        Read code blocks back from annotated code. Blocks that are unchanged
+        with respect to the `blocks` index in the filedb are skipped, so that
+        changes to the same blocks in the markup are kept.
+        """
+        for p in self.content:
+            _ = self.source(t, p)
         reader = code(numbered_lines(path, t.read(path)))
         for block in reader:
-            self.reference_map[block.reference_id].source = block.content
+            ref = block.reference_id
+            if t.db.blocks.get(ref.key) == ref.source_digest(block.content):
+                continue
+            self.reference_map[ref].source = block.content
         t.update(path)
 
     def load_all_code(self, t: Transaction):
+        """
+        Read code blocks back from all targets that were changed since they
+        were last written, according to the filedb. Other targets are known
+        to match the markdown as loaded, so they are not parsed.
+        """
         log.debug(f"Targets: {self.reference_map.targets()}")
         for tgt in self.reference_map.targets():
+            path = Path(tgt)
+            if path not in t.fs:
+                continue
+            if path in t.db and t.fs.stat(path) == t.db[path]:
+                continue
             log.debug(f"Reading code: `{tgt}`")
-            if Path(tgt) in t.fs:
-                self.load_code(t, Path(tgt))
+            self.load_code(t, path)
 
-    def load(self, t: Transaction):
+    def load(self, t: Transaction) -> ConfigUpdate | None:
+        """
+        Read all markup files. With a single input file, its header updates
+        the configuration of the document; that update is returned.
+        """
         files = get_input_files(t.fs, self.config)
         if len(files) == 1:
             log.debug(f"single input file `{files[0]}`")
-            self.context |= self.load_source(t, files[0])
+            update = self.load_source(t, files[0])
+            self.context |= update
+            return update
         else:
             log.debug("multiple input files")
             for p in files:
                 self.load_source(t, p)
+            return None
 
-    def tangle(self, t: Transaction, annotation: AnnotationMethod | None = None):
+    def block_digests(self) -> dict[str, str]:
+        """Source digests of all code blocks, see `ReferenceId.source_digest`."""
+        return {ref.key: code_block.source_digest(ref)
+                for ref, code_block in self.reference_map.items()}
+
+    def reference_digests(self) -> dict[str, str]:
+        return {str(name): self.reference_map.name_digest(name)
+                for name in self.reference_map.names()}
+
+    def outdated_targets(self, db: FileDB, graph: ReferenceGraph, digests: dict[str, str],
+                         annotation: AnnotationMethod) -> set[PurePath]:
+        """
+        Find the targets that need to be tangled again: targets that are not
+        yet known in the filedb, and targets that depend on a reference
+        name whose digest differs from the one stored in the filedb.
+        """
+        refs = self.reference_map
+        targets = set(refs.targets())
+        if db.annotation != annotation:
+            return targets
+
+        changed = (name for name in refs.names()
+                   if db.references.get(str(name)) != digests[str(name)])
+        dependents = graph.dependents(changed)
+        return {tgt for tgt in targets
+                if tgt.as_posix() not in db.targets or Path(tgt) not in db
+                or refs.select_by_target(tgt) in dependents}
+
+    def tangle_key(self, graph: ReferenceGraph, digests: dict[str, str], root: ReferenceName,
+                   annotation: AnnotationMethod) -> str:
+        """
+        A key for the output of tangling `root`: the digest of the ordered
+        digests of all code blocks that contribute to it, and the annotation
+        method. Language comment styles are part of the code block digests.
+        """
+        h = hashlib.sha256(f"{annotation}\n".encode())
+        for name in graph.reachable([root]):
+            h.update(f"{name}:{digests[str(name)]}\n".encode())
+        return h.hexdigest()
+
+    def tangle(self, t: Transaction, annotation: AnnotationMethod | None = None, jobs: int = 1):
+        """
+        Tangle all targets that need it, see `outdated_targets` and
+        `tangle_key`. With `jobs` larger than one, targets are tangled using
+        a pool of workers; the results are written in the same order.
+        """
         if annotation is None:
             annotation = self.config.annotation
 
         for h in self.context.all_hooks:
             h.pre_tangle(self.reference_map)
 
-        for tgt in self.reference_map.targets():
-            self.write_target(t, Path(tgt), annotation)
+        targets = list(self.reference_map.targets())
+        graph = ReferenceGraph.from_map(self.reference_map)
+        graph.check(map(self.reference_map.select_by_target, targets))
+
+        digests = self.reference_digests()
+        outdated = self.outdated_targets(t.db, graph, digests, annotation)
+        log.debug("%d out of %d targets need tangling", len(outdated), len(targets))
+
+        pending: list[Path] = []
+        tangle_keys: dict[str, str] = {}
+        for tgt in targets:
+            key = t.db.tangle_keys.get(tgt.as_posix())
+            if tgt in outdated or key is None:
+                # Some dependency changed, but the output may still be the same.
+                old_key = key
+                key = self.tangle_key(graph, digests, self.reference_map.select_by_target(tgt), annotation)
+                if key != old_key or Path(tgt) not in t.db:
+                    pending.append(Path(tgt))
+                else:
+                    t.keep(Path(tgt))
+            else:
+                t.keep(Path(tgt))
+            tangle_keys[tgt.as_posix()] = key
+
+        if jobs > 1 and len(pending) > 1:
+            names = [self.reference_map.select_by_target(tgt) for tgt in pending]
+            results = tangle_parallel(self.reference_map, names, annotation, jobs)
+            for tgt, name, (text, deps) in zip(pending, names, results):
+                main_block = self.reference_map[self.reference_map.select_by_name(name)[0]]
+                t.write(tgt, text, map(Path, deps), main_block.mode)
+        else:
+            cache = TangleCache.for_roots(self.reference_map,
+                                          map(self.reference_map.select_by_target, pending))
+            for tgt in pending:
+                self.write_target(t, tgt, annotation, cache, checked=True)
+        t.update_tangle_index(annotation, digests, tangle_keys)
+        t.update_blocks(self.block_digests())
 
         for h in self.context.all_hooks:
             h.on_tangle(t, self.reference_map)
 
     def stitch(self, t: Transaction):
+        """
+        Write changed code blocks back into the markup files. Only the text of
+        changed code blocks is replaced, and files without changes are not
+        written at all.
+        """
         for path in self.content:
-            text, deps = self.source_text(path)
+            if (source := self.source_texts.get(path)) is None:
+                text, deps = self.source_text(path)
+            elif (text := source.patch(self.reference_map)) is not None:
+                deps = source.deps
+            elif source.text != t.read(path):
+                text, deps = source.text, source.deps
+            else:
+                continue
             t.write(path, text, map(Path, deps))
+        t.update_blocks(self.block_digests())
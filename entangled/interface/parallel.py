@@ -0,0 +1,81 @@
+from collections.abc import Iterator, Sequence
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import PurePath
+
+import multiprocessing
+import threading
+
+from ..config import AnnotationMethod
+from ..errors.internal import InternalError
+from ..errors.user import UserError
+from ..model import ReferenceMap, TangleCache, tangle_ref
+from ..model.reference_name import ReferenceName
+from ..logging import logger
+
+
+log = logger()
+
+
+# The reference map that is shared with the workers. When processes are
+# started by forking, the workers inherit this memory, so the reference map
+# is never serialized.
+_shared: tuple[ReferenceMap, AnnotationMethod, TangleCache] | None = None
+
+
+def _tangle_worker(name: ReferenceName) -> tuple[str, set[PurePath]] | None:
+    assert _shared is not None
+    refs, annotation, cache = _shared
+    try:
+        return tangle_ref(refs, name, annotation, cache, checked=True)
+    except UserError:
+        # User errors are reported from the main process, see `tangle_parallel`.
+        return None
+
+
+def _executor(jobs: int) -> Executor:
+    # Forking a process that runs other threads, as in watch mode or from
+    # `entangled serve`, may leave locks held in the child.
+    if threading.active_count() > 1:
+        log.debug("other threads are running, tangling in threads")
+        return ThreadPoolExecutor(jobs)
+    if "fork" in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("fork"))
+    log.debug("fork is not available, tangling in threads")
+    return ThreadPoolExecutor(jobs)
+
+
+def tangle_parallel(
+    refs: ReferenceMap,
+    names: Sequence[ReferenceName],
+    annotation: AnnotationMethod,
+    jobs: int,
+) -> Iterator[tuple[str, set[PurePath]]]:
+    """
+    Tangle the given reference names using a pool of `jobs` workers. The
+    references should be validated with `check_references` beforehand.
+    Results are yielded in the same order as `names`, each as soon as it
+    is ready, so that they can be written while others are still running.
+
+    If a worker fails with a `UserError`, the name is tangled again in the
+    main process, so that the error is raised from there. Other errors are
+    raised as they are.
+
+    Processes are only forked when no other threads are running. In watch
+    mode and from `entangled serve` the workers are threads, so there
+    tangling in parallel gives no speedup.
+    """
+    global _shared
+    if _shared is not None:
+        raise InternalError("Parallel tangle is not reentrant", [])
+
+    _shared = (refs, annotation, TangleCache.for_roots(refs, names))
+    try:
+        with _executor(jobs) as pool:
+            chunksize = max(1, len(names) // (4 * jobs))
+            results = pool.map(_tangle_worker, names, chunksize=chunksize)
+            for name, result in zip(names, results, strict=True):
+                if result is None:
+                    result = tangle_ref(refs, name, annotation)
+                yield result
+    finally:
+        _shared = None
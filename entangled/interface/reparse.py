@@ -0,0 +1,214 @@
+"""
+Incremental reading of markup files. When a large markup file is edited,
+usually only a small part of it changes. The text between the first and the
+last changed byte is read again, extended to the code blocks it touches; the
+code blocks before and after are kept from the previous read.
+"""
+
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from pathlib import Path
+
+from ..config import ConfigUpdate
+from ..errors.user import UserError
+from ..iterators import numbered_lines, run_generator
+from ..model import CodeBlock, Content, PlainText, ReferenceId, ReferenceMap, ReferenceName, SourceText
+from ..model.content import BlockSpan
+from ..model.properties import get_attribute_string, get_id
+from ..readers import collect_plain_text, process_token, raw_markdown, read_yaml_header
+from ..readers.yaml_header import get_config
+from ..text_location import TextLocation
+
+from .context import Context
+
+
+_CHUNK = 4096
+
+
+def common_prefix(a: str, b: str) -> int:
+    """Length of the common prefix of two strings."""
+    n = min(len(a), len(b))
+    pos = 0
+    while pos < n:
+        end = min(n, pos + _CHUNK)
+        if a[pos:end] != b[pos:end]:
+            while a[pos] == b[pos]:
+                pos += 1
+            return pos
+        pos = end
+    return n
+
+
+def common_suffix(a: str, b: str, limit: int) -> int:
+    """Length of the common suffix of two strings, up to `limit`."""
+    la, lb = len(a), len(b)
+    pos = 0
+    while pos < limit:
+        end = min(limit, pos + _CHUNK)
+        if a[la - end:la - pos] != b[lb - end:lb - pos]:
+            while a[la - pos - 1] == b[lb - pos - 1]:
+                pos += 1
+            return pos
+        pos = end
+    return limit
+
+
+@dataclass
+class Reparsed:
+    """
+    The result of `reparse`.
+
+    Attributes:
+        content: the content of the markup file.
+        blocks: all code blocks in the file, in order, to be passed to
+            `ReferenceMap.replace_file`.
+        source: the text of the file with spans of its code blocks.
+        update: the configuration set in the header of the file.
+    """
+    content: list[Content]
+    blocks: list[tuple[ReferenceId, CodeBlock]]
+    source: SourceText
+    update: ConfigUpdate | None
+
+
+def is_unnamed(code_block: CodeBlock) -> bool:
+    """Whether the name of a code block is derived from its location."""
+    return get_id(code_block.properties) is None \
+        and get_attribute_string(code_block.properties, "file") is None
+
+
+def item_starts(content: list[Content], source: SourceText) -> list[int] | None:
+    """Offsets of all items of content in the text, followed by the length
+    of the text. Returns `None` if the content doesn't match the text."""
+    spans = iter(source.blocks)
+    starts: list[int] = []
+    pos = 0
+    for c in content:
+        starts.append(pos)
+        match c:
+            case PlainText(s):
+                pos += len(s)
+            case ReferenceId():
+                span = next(spans, None)
+                if span is None or span.ref != c or span.start != pos:
+                    return None
+                pos = span.end
+    if pos != len(source.text):
+        return None
+    starts.append(pos)
+    return starts
+
+
+def reparse(context: Context, refs: ReferenceMap, path: Path, content: list[Content],
+            source: SourceText, text: str) -> Reparsed | None:
+    """
+    Read a markup file that changed from `source.text` to `text`, only
+    parsing the region that changed. Reference ids are numbered as if the
+    file was read in full, and the line numbers of code blocks following
+    the change are shifted.
+
+    Apart from the line numbers, the reference map is not changed. Returns
+    `None` if the change can't be read on its own, in which case the file
+    should be read in full.
+    """
+    if not source.verbatim or len(content) < 3:
+        return None
+    old = source.text
+    if (starts := item_starts(content, source)) is None:
+        return None
+
+    n = len(content)
+    prefix = common_prefix(old, text)
+    suffix = common_suffix(old, text, min(len(old), len(text)) - prefix)
+    delta = len(text) - len(old)
+
+    # The changed region runs from the first item that ends at or after the
+    # first change, to the last item that starts at or before the last one.
+    first = bisect_left(starts, prefix, 1) - 1
+    last = bisect_right(starts, len(old) - suffix, 0, n) - 1
+    # The YAML header and the configuration it sets are read in full.
+    if first < 2:
+        return None
+    # The region should end with a code block, so that the reader is in the
+    # same state after the region as it was before.
+    while last < n - 1 and (not isinstance(content[last], ReferenceId)
+                            or text[starts[last + 1] + delta - 1] != "\n"):
+        last += 1
+
+    start, end = starts[first], starts[last + 1]
+    region = text[start:end + delta]
+    line_number = old.count("\n", 0, start) + 1
+    line_delta = region.count("\n") - old.count("\n", start, end)
+
+    try:
+        _, header = run_generator(read_yaml_header(numbered_lines(path, text)))
+        update = get_config(header)
+        region_context = context | update
+        scratch = ReferenceMap()
+        tokens = list(map(
+            lambda token: process_token(region_context.hooks, scratch, token),
+            collect_plain_text(raw_markdown(region_context.config,
+                                            numbered_lines(path, region, line_number)))))
+    except UserError:
+        return None
+
+    if end + delta < len(text):
+        # A file ending in a newline is followed by an empty line.
+        if tokens and tokens[-1] == PlainText(""):
+            _ = tokens.pop()
+        if not tokens or not isinstance(tokens[-1], ReferenceId):
+            return None
+
+    parsed: list[PlainText | CodeBlock] = [
+        scratch[t] if isinstance(t, ReferenceId) else t for t in tokens]
+    if "".join(t.content if isinstance(t, PlainText) else t.indented_text for t in parsed) != region:
+        return None
+
+    items: list[PlainText | CodeBlock] = [
+        refs[c] if isinstance(c, ReferenceId) else c for c in content[:first]]
+    for item in parsed:
+        if isinstance(item, PlainText) and items and isinstance(items[-1], PlainText):
+            items[-1] = PlainText(items[-1].content + item.content)
+        else:
+            items.append(item)
+    for c in content[last + 1:]:
+        if isinstance(c, PlainText):
+            if isinstance(items[-1], PlainText):
+                items[-1] = PlainText(items[-1].content + c.content)
+            else:
+                items.append(c)
+            continue
+        code_block = refs[c]
+        if line_delta:
+            code_block.origin = TextLocation(code_block.origin.filename,
+                                             code_block.origin.line_number + line_delta)
+        items.append(code_block)
+
+    names = {id(refs[c]): c.name for c in content if isinstance(c, ReferenceId)} \
+        | {id(code_block): ref.name for ref, code_block in scratch.items()}
+    counts: dict[ReferenceName, int] = {}
+    new_content: list[Content] = []
+    blocks: list[tuple[ReferenceId, CodeBlock]] = []
+    spans: list[BlockSpan] = []
+    pos = 0
+    for item in items:
+        if isinstance(item, PlainText):
+            new_content.append(item)
+            pos += len(item.content)
+            continue
+
+        if is_unnamed(item):
+            name = ReferenceName(item.namespace, f"unnamed-{item.origin}")
+        else:
+            name = names[id(item)]
+        ref = ReferenceId(name, path, counts.get(name, 0))
+        counts[name] = ref.ref_count + 1
+        new_content.append(ref)
+        blocks.append((ref, item))
+        length = len(item.indented_text)
+        spans.append(BlockSpan(ref, pos, pos + length, item.header, item.source))
+        pos += length
+
+    deps = source.deps | {item.origin.filename for item in parsed if isinstance(item, CodeBlock)}
+    return Reparsed(new_content, blocks, SourceText(text, spans, deps, verbatim=True), update)
+
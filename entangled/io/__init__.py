@@ -3,9 +3,9 @@ In Entangled all file IO should pass through a transaction.
 """
 
 
-from .transaction import transaction, Transaction, TransactionMode
+from .transaction import transaction, Transaction, TransactionCancelled, TransactionMode
 from .filedb import filedb
 from .virtual import AbstractFileCache, FileCache, VirtualFS
 
 
-__all__ = ["AbstractFileCache", "FileCache", "filedb", "Transaction", "TransactionMode", "transaction", "VirtualFS"]
+__all__ = ["AbstractFileCache", "FileCache", "filedb", "Transaction", "TransactionCancelled", "TransactionMode", "transaction", "VirtualFS"]
@@ -29,15 +29,35 @@ class FileDB(Struct):
     too confused when switching branches.
 
     All files are stored in a single dictionary, the distinction between
-    source and target files is made in two separate indices."""
+    source and target files is made in two separate indices.
+
+    For incremental tangling, we also store a digest for every reference name,
+    together with the annotation method that was used in the last tangle.
+    Only targets that depend on a name whose digest changed need to be
+    tangled again. In addition, every target has a key that digests all
+    code blocks that contributed to it. If that key is unchanged, the target
+    doesn't need to be tangled.
+
+    The `blocks` index records the source digest of every code block (see
+    `ReferenceId.source_digest`) as of the last time markup and code were
+    brought in sync. Comparing against it, we can tell for each block
+    whether it was changed in the markup, in the code, or both."""
 
     version: str
     files: dict[str, Stat]
     targets: set[str]
+    annotation: str | None = None
+    references: dict[str, str] = msgspec.field(default_factory=dict)
+    tangle_keys: dict[str, str] = msgspec.field(default_factory=dict)
+    blocks: dict[str, str] = msgspec.field(default_factory=dict)
 
     def clear(self):
         self.files = {}
         self.targets = set()
+        self.annotation = None
+        self.references = {}
+        self.tangle_keys = {}
+        self.blocks = {}
 
     @property
     def managed_files(self) -> set[Path]:
@@ -54,7 +74,7 @@ class FileDB(Struct):
         # deleted) counts as changed. Without this guard `fs[Path(p)]` would
         # raise `FileNotFoundError` and crash, see issue #88.
         return (Path(p) for p, known_stat in self.files.items()
-                if Path(p) not in fs or fs[Path(p)].stat != known_stat)
+                if Path(p) not in fs or fs.stat(Path(p)) != known_stat)
 
     def create_target(self, fs: AbstractFileCache, path: Path):
         if path.is_absolute():
@@ -66,7 +86,7 @@ class FileDB(Struct):
         if path.is_absolute():
             path = path.relative_to(Path.cwd())
         if path in fs:
-            self.files[path.as_posix()] = fs[path].stat
+            self.files[path.as_posix()] = fs.stat(path)
 
     def __contains__(self, path: Path) -> bool:
         return path.as_posix() in self.files
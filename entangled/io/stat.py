@@ -19,6 +19,27 @@ def hexdigest(s: str) -> str:
     return hashlib.sha256(content).hexdigest()
 
 
+class HexDigest:
+    """Computes the same digest as `hexdigest`, incrementally from a sequence
+    of chunks. Trailing whitespace is held back until we know that it is not
+    at the end of the content."""
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._pending = ""
+
+    def update(self, chunk: str):
+        chunk = chunk.replace("\r", "")
+        stripped = chunk.rstrip()
+        if stripped:
+            self._hash.update((self._pending + stripped).encode())
+            self._pending = chunk[len(stripped):]
+        else:
+            self._pending += chunk
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
 @dataclass
 class Stat:
     modified: datetime
@@ -1,10 +1,11 @@
 from abc import ABCMeta, abstractmethod
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
 from dataclasses import dataclass, field
 from functools import cached_property
-from pathlib import Path
+from pathlib import Path, PurePath
 from contextlib import contextmanager
 from enum import Enum
+from threading import Event
 
 import logging
 from typing import override
@@ -13,8 +14,8 @@ from ..utility import cat_maybes
 from ..errors.internal import InternalError
 
 from .stat import Stat, hexdigest
-from .virtual import AbstractFileCache, FileCache, VirtualFS
-from .filedb import FileDB, filedb
+from .virtual import AbstractFileCache, FileCache, Staged, VirtualFS
+from .filedb import FileDB, filedb, write_filedb
 
 
 @dataclass(frozen=True)
@@ -52,29 +53,35 @@ class Action(metaclass=ABCMeta):
     def target_stat(self, fs: AbstractFileCache) -> Stat | None:
         if self.target not in fs:
             return None
-        return fs[self.target].stat
+        return fs.stat(self.target)
 
 
 @dataclass(frozen=True)
 class WriterBase(Action, metaclass=ABCMeta):
-    content: str
+    """
+    Writes `content` to the target. The content is either a string, or was
+    streamed to a temporary file by `AbstractFileCache.stage`.
+    """
+    content: str | Staged
     mode: int | None
     sources: list[Path]
 
     @cached_property
     def content_digest(self) -> str:
+        if isinstance(self.content, Staged):
+            return self.content.hexdigest
         return hexdigest(self.content)
 
     @override
     def run(self, fs: AbstractFileCache):
-        fs.write(self.target, self.content, self.mode)
+        fs.commit(self.target, self.content, self.mode)
 
 
 class Create(WriterBase):
     @override
     def conflict(self, fs: AbstractFileCache, db: FileDB) -> Conflict | None:
         if self.target in fs:
-            if (self.content_digest == fs[self.target].stat.hexdigest):
+            if (self.content_digest == fs.stat(self.target).hexdigest):
                 return None
             return Conflict(self.target, "not managed by Entangled")
         return None
@@ -100,7 +107,7 @@ class Write(WriterBase):
         # the latter gives false positives when the dependency graph changes,
         # e.g. when a target no longer depends on one of its former sources
         # (see issue #96).
-        if fs[self.target].stat != db[self.target]:
+        if fs.stat(self.target) != db[self.target]:
             return Conflict(self.target, "changed outside the control of Entangled")
         return None
 
@@ -116,7 +123,7 @@ class Write(WriterBase):
 class Delete(Action):
     @override
     def conflict(self, fs: AbstractFileCache, db: FileDB) -> Conflict | None:
-        if fs[self.target].stat != db[self.target]:
+        if fs.stat(self.target) != db[self.target]:
             return Conflict(self.target, "changed outside the control of Entangled")
         return None
 
@@ -139,29 +146,99 @@ class Transaction:
     Collects a set of file mutations, checking for consistency. All file IO outside of
     the `entangled.io` module should pass through this class, used with the context
     manager function `transaction`.
+
+    A `pipelined` transaction runs every action that has no conflict as soon
+    as it is added, so that targets appear on disk while others are still
+    being computed. The remaining actions, updates to the filedb and removal
+    of orphans are done when the transaction is run as usual.
     """
     db: FileDB
     fs: AbstractFileCache = field(default_factory=FileCache)
     updates: list[Path] = field(default_factory=list)
     actions: list[Action] = field(default_factory=list)
     passed: set[Path] = field(default_factory=set)
+    pipelined: bool = False
+    committed: list[Action] = field(default_factory=list)
+    cancel: Event | None = None
+    tangle_index: tuple[str, dict[str, str], dict[str, str]] | None = None
+    blocks: dict[str, str] | None = None
 
     def update(self, path: Path):
         self.updates.append(path)
 
+    def update_tangle_index(self, annotation: str, references: dict[str, str], tangle_keys: dict[str, str]):
+        """Store the digests of all reference names and the keys of all
+        targets in the filedb, once the transaction is run."""
+        self.tangle_index = (annotation, references, tangle_keys)
+
+    def update_blocks(self, blocks: dict[str, str]):
+        """Store the source digests of all code blocks in the filedb, once
+        the transaction is run."""
+        self.blocks = blocks
+
+    def keep(self, path: Path):
+        """Mark a target as passed without writing to it, because its content
+        is known to be unchanged."""
+        if path in self.passed:
+            raise InternalError("Path is being written to twice", [path])
+        self.passed.add(path)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+    def add_action(self, action: Action):
+        """Add an action to the transaction, or run it right away if the
+        transaction is pipelined and the action has no conflicts."""
+        if self.pipelined and not self.cancelled and action.conflict(self.fs, self.db) is None:
+            logging.info(str(action))
+            action.run(self.fs)
+            action.add_to_db(self.fs, self.db)
+            self.committed.append(action)
+        else:
+            self.actions.append(action)
+
     def write(self, path: Path, content: str, sources: Iterable[Path], mode: int | None = None):
         if path in self.passed:
             raise InternalError("Path is being written to twice", [path])
         self.passed.add(path)
         if path not in self.db:
             logging.debug("creating target `%s`", path)
-            self.actions.append(Create(path, content, mode, list(sources)))
+            self.add_action(Create(path, content, mode, list(sources)))
         elif not self.db.check(path, content):
             logging.debug("target `%s` changed", path)
-            self.actions.append(Write(path, content, mode, list(sources)))
+            self.add_action(Write(path, content, mode, list(sources)))
         else:
             logging.debug("target `%s` unchanged", path)
 
+    def write_stream(self, path: Path, chunks: Iterator[str], sources: Iterable[PurePath], mode: int | None = None):
+        """
+        Like `write`, but the content is given as a sequence of chunks, which
+        the file system may stream to a temporary file. The `sources` are
+        only iterated after all chunks are consumed, so they may be collected
+        while generating the chunks.
+        """
+        if path in self.passed:
+            raise InternalError("Path is being written to twice", [path])
+        self.passed.add(path)
+        content = self.fs.stage(chunks, mode)
+        digest = content.hexdigest if isinstance(content, Staged) else hexdigest(content)
+        if path not in self.db:
+            logging.debug("creating target `%s`", path)
+            self.add_action(Create(path, content, mode, [Path(p) for p in sources]))
+        elif digest != self.db[path].hexdigest:
+            logging.debug("target `%s` changed", path)
+            self.add_action(Write(path, content, mode, [Path(p) for p in sources]))
+        else:
+            logging.debug("target `%s` unchanged", path)
+            self.fs.discard(content)
+
+    def discard(self):
+        """Clean up staged content of actions that were not run."""
+        for a in self.actions:
+            if isinstance(a, WriterBase):
+                self.fs.discard(a.content)
+
     def read(self, path: Path) -> str:
         return self.fs[path].content
 
@@ -181,7 +258,7 @@ class Transaction:
         return all(a.conflict(self.fs, self.db) is None for a in self.actions)
 
     def print_plan(self):
-        if not self.actions:
+        if not self.actions and not self.committed:
             logging.info("Nothing to be done.")
         for a in self.actions:
             logging.info(str(a))
@@ -192,14 +269,23 @@ class Transaction:
         for a in self.actions:
             a.run(self.fs)
             a.add_to_db(self.fs, self.db)
+        self.committed.extend(self.actions)
         for f in self.updates:
             self.db.update(self.fs, f)
+        self.update_db_indices()
 
     def updatedb(self):
         for a in self.actions:
             a.add_to_db(self.fs, self.db)
         for f in self.updates:
             self.db.update(self.fs, f)
+        self.update_db_indices()
+
+    def update_db_indices(self):
+        if self.tangle_index is not None:
+            self.db.annotation, self.db.references, self.db.tangle_keys = self.tangle_index
+        if self.blocks is not None:
+            self.db.blocks = self.blocks
 
 
 class TransactionMode(Enum):
@@ -219,8 +305,28 @@ class TransactionMode(Enum):
     RESETDB = 5
 
 
+class TransactionCancelled(Exception):
+    """The transaction was cancelled before all actions were run."""
+    pass
+
+
 @contextmanager
-def transaction(mode: TransactionMode = TransactionMode.FAIL, fs: AbstractFileCache | None = None):
+def transaction(mode: TransactionMode = TransactionMode.FAIL, fs: AbstractFileCache | None = None,
+                pipelined: bool = False, cancel: Event | None = None,
+                committed: list[Action] | None = None):
+    """
+    Open a transaction. All file mutations are collected and checked for
+    conflicts before being executed, according to `mode`. If `pipelined`
+    is set, writes without conflict are executed right away, see
+    `Transaction`. This only has an effect in modes that write files.
+
+    Once `cancel` is set, no further actions are run. The filedb is
+    updated for the actions that did run, after which
+    `TransactionCancelled` is raised. Actions that are run are appended
+    to `committed`, if given, as soon as they are run. The same holds when
+    an exception is raised after some actions were run: files that are on
+    disk are recorded in the filedb before the exception is passed on.
+    """
     if fs is None:
         fs = FileCache()
 
@@ -230,38 +336,56 @@ def transaction(mode: TransactionMode = TransactionMode.FAIL, fs: AbstractFileCa
         if mode == TransactionMode.RESETDB:
             db.clear()
 
-        tr = Transaction(db, fs)
-
-        logging.debug("Open transaction")
-        yield tr
-
-        tr.print_plan()
+        pipelined = pipelined and mode in (TransactionMode.FAIL, TransactionMode.CONFIRM, TransactionMode.FORCE)
+        tr = Transaction(db, fs, pipelined=pipelined, cancel=cancel,
+                         committed=[] if committed is None else committed)
+        cancelled = False
+        try:
+            logging.debug("Open transaction")
+            yield tr
+            if not (cancelled := tr.cancelled):
+                run_transaction(tr, mode)
+        except BaseException:
+            if tr.pipelined or tr.committed:
+                write_filedb(db, fs)
+            raise
+        finally:
+            tr.discard()
+
+    if cancelled:
+        logging.info("transaction cancelled")
+        raise TransactionCancelled()
+
+
+def run_transaction(tr: Transaction, mode: TransactionMode):
+    """Run the transaction, according to `mode`."""
+    tr.print_plan()
+
+    match mode:
+        case TransactionMode.SHOW:
+            logging.info("nothing is done")
+            return
 
-        match mode:
-            case TransactionMode.SHOW:
-                logging.info("nothing is done")
-                return
+        case TransactionMode.RESETDB:
+            logging.info("rebuilding database")
+            tr.updatedb()
+            return
 
-            case TransactionMode.RESETDB:
-                logging.info("rebuilding database")
-                tr.updatedb()
+        case TransactionMode.FAIL:
+            if not tr.all_ok():
+                logging.error(
+                    "conflicts found, breaking off (use `--force` to run anyway)"
+                )
                 return
 
-            case TransactionMode.FAIL:
-                if not tr.all_ok():
-                    logging.error(
-                        "conflicts found, breaking off (use `--force` to run anyway)"
-                    )
+        case TransactionMode.CONFIRM:
+            if not tr.all_ok():
+                reply = input("Ok to continue? (y/n) ")
+                if not (reply == "y" or reply == "yes"):
                     return
 
-            case TransactionMode.CONFIRM:
-                if not tr.all_ok():
-                    reply = input("Ok to continue? (y/n) ")
-                    if not (reply == "y" or reply == "yes"):
-                        return
-
-            case TransactionMode.FORCE:
-                logging.warning("conflicts found, but continuing anyway")
+        case TransactionMode.FORCE:
+            logging.warning("conflicts found, but continuing anyway")
 
-        logging.debug("Executing transaction")
-        tr.run()
+    logging.debug("Executing transaction")
+    tr.run()
@@ -14,7 +14,7 @@ from datetime import datetime
 import os
 import tempfile
 
-from .stat import hexdigest, stat, FileData, Stat
+from .stat import HexDigest, hexdigest, stat, FileData, Stat
 from ..logging import logger
 
 log = logger()
@@ -44,6 +44,46 @@ def atomic_write(target: Path, content: str, mode: int | None):
     os.replace(f.name, target)
 
 
+@dataclass(frozen=True)
+class Staged:
+    """
+    Content that was streamed to a temporary file by `FileCache.stage`,
+    waiting to be moved to its target by `FileCache.commit`.
+    """
+    path: Path
+    hexdigest: str
+
+
+def stream_to_temp(chunks: Iterable[str], mode: int | None) -> Staged:
+    """
+    Write chunks of text to a temporary file, computing its digest on the
+    fly. The temporary file lives in the same location as the ones used by
+    `atomic_write`, so that it can be moved to its target atomically.
+    """
+    tmp_dir = Path() / ".entangled" / "tmp"
+    tmp_dir.mkdir(exist_ok=True, parents=True)
+    digest = HexDigest()
+    last = "\n"
+    with tempfile.NamedTemporaryFile(mode="w", delete=False, dir=tmp_dir, encoding="utf-8") as f:
+        try:
+            for chunk in chunks:
+                if chunk:
+                    _ = f.write(chunk)
+                    digest.update(chunk)
+                    last = chunk[-1]
+            if last != "\n":
+                _ = f.write("\n")
+            f.flush()
+            if mode is not None:
+                os.chmod(f.name, mode)
+            os.fsync(f.fileno())
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    return Staged(Path(f.name), digest.hexdigest())
+
+
 class AbstractFileCache(ABC):
     @classmethod
     @abstractmethod
@@ -70,6 +110,26 @@ class AbstractFileCache(ABC):
     def write(self, key: Path, content: str, mode: int | None = None):
         ...
 
+    def stage(self, chunks: Iterable[str], mode: int | None = None) -> str | Staged:
+        """
+        Prepare content for writing with `commit`. File systems that can,
+        stream the content to a temporary file, so that it never has to be
+        held in memory as a whole. By default the chunks are joined.
+        """
+        return "".join(chunks)
+
+    def commit(self, key: Path, content: str | Staged, mode: int | None = None):
+        """Write content that was prepared with `stage`."""
+        assert isinstance(content, str)
+        self.write(key, content, mode)
+
+    def discard(self, content: str | Staged):
+        """Clean up content that was prepared with `stage` but not committed."""
+        pass
+
+    def stat(self, key: Path) -> Stat:
+        return self[key].stat
+
     def reset(self):
         pass
 
@@ -116,6 +176,7 @@ class FileCache(AbstractFileCache):
     This acts as a mapping from `Path` to `FileData`. Removing items actually deletes files.
     """
     _data: dict[Path, FileData] = field(default_factory=dict)
+    _stats: dict[Path, Stat] = field(default_factory=dict)
 
     @classmethod
     def is_for_real(cls) -> bool:
@@ -154,6 +215,7 @@ class FileCache(AbstractFileCache):
             parent = parent.parent
         if key in self._data:
             del self._data[key]
+        _ = self._stats.pop(key, None)
 
     @override
     def glob(self, pattern: str) -> Iterable[Path]:
@@ -169,18 +231,62 @@ class FileCache(AbstractFileCache):
         """
         if key in self:
             new_digest = hexdigest(content)
-            if new_digest == self[key].stat.hexdigest:
+            if new_digest == self.stat(key).hexdigest:
                 log.debug("Not writing `{key}`, content same")
                 return
-            del self._data[key]
+            _ = self._data.pop(key, None)
 
         log.debug(f"Writing `{key}`")
+        _ = self._stats.pop(key, None)
         key.parent.mkdir(parents=True, exist_ok=True)
         atomic_write(key, content, mode)
 
+    @override
+    def stage(self, chunks: Iterable[str], mode: int | None = None) -> str | Staged:
+        return stream_to_temp(chunks, mode)
+
+    @override
+    def commit(self, key: Path, content: str | Staged, mode: int | None = None):
+        """
+        Move staged content to its target. As with `write`, nothing is done
+        if the target has the same digest. The stat of the new file is
+        cached, so that the content doesn't need to be read back for updating
+        the file database.
+        """
+        if isinstance(content, str):
+            return self.write(key, content, mode)
+
+        if key in self:
+            if content.hexdigest == self.stat(key).hexdigest:
+                log.debug("Not writing `{key}`, content same")
+                self.discard(content)
+                return
+            _ = self._data.pop(key, None)
+
+        log.debug(f"Writing `{key}`")
+        key.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(content.path, key)
+        self._stats[key] = Stat(datetime.fromtimestamp(os.stat(key).st_mtime), content.hexdigest)
+
+    @override
+    def discard(self, content: str | Staged):
+        if isinstance(content, Staged):
+            content.path.unlink(missing_ok=True)
+
+    @override
+    def stat(self, key: Path) -> Stat:
+        """
+        Get the `Stat` of a file. For files that were committed from staged
+        content, this doesn't read the file.
+        """
+        if key not in self._data and key in self._stats:
+            return self._stats[key]
+        return self[key].stat
+
     @override
     def reset(self):
         """
         Reset the cache. Doesn't perform any IO.
         """
         self._data = {}
+        self._stats = {}
@@ -1,7 +1,7 @@
 from collections.abc import Generator
 from pathlib import PurePath
 
-from ..text_location import TextLocation
+from ..text_location import TextLocation, intern_filename
 
 from .peekable import peekable
 
@@ -19,7 +19,9 @@ def lines(text: str) -> Generator[str]:
 
 
 @peekable
-def numbered_lines(filename: PurePath, text: str) -> Generator[InputToken]:
-    """Iterate the lines in a file. Doesn't strip newlines."""
-    for n, line in enumerate(lines(text)):
-        yield (TextLocation(filename, n+1), line)
+def numbered_lines(filename: PurePath, text: str, start: int = 1) -> Generator[InputToken]:
+    """Iterate the lines in a file. Doesn't strip newlines. If `text` is
+    part of a file, `start` gives the line number of its first line."""
+    filename = intern_filename(filename)
+    for n, line in enumerate(lines(text), start):
+        yield (TextLocation(filename, n), line)
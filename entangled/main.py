@@ -1,15 +1,19 @@
-from .logging import logger
-
 import sys
 import traceback
 
-from .commands import main
-from .errors.internal import bug_contact
-from .errors.user import HelpfulUserError, UserError
-from .version import __version__
+from .client import forward
 
 
 def cli():
+    # Forward to `entangled serve` before importing anything else.
+    if (code := forward(sys.argv[1:])) is not None:
+        sys.exit(code)
+
+    from .commands import main
+    from .errors.internal import bug_contact
+    from .errors.user import HelpfulUserError, UserError
+    from .logging import logger
+
     try:
         main()
     except KeyboardInterrupt:
@@ -1,10 +1,11 @@
-from .content import PlainText, Content, RawContent, content_to_text
+from .content import PlainText, Content, RawContent, SourceText, content_to_text
 from .code_block import CodeBlock
 from .properties import Id, Class, Attribute, Property
 from .reference_name import ReferenceName
 from .reference_id import ReferenceId
 from .reference_map import ReferenceMap
-from .tangle import tangle_ref
+from .tangle import tangle_ref, tangle_stream, TangleCache
+from .reference_graph import ReferenceGraph, check_references
 
 __all__ = [
     "Id",
@@ -14,10 +15,15 @@ __all__ = [
     "PlainText",
     "Content",
     "RawContent",
+    "SourceText",
     "CodeBlock",
     "ReferenceName",
     "ReferenceId",
     "ReferenceMap",
     "tangle_ref",
+    "tangle_stream",
+    "TangleCache",
+    "ReferenceGraph",
+    "check_references",
     "content_to_text"
 ]
@@ -1,12 +1,15 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Literal
 
+import hashlib
 import os
 
 from ..text_location import TextLocation
 from ..iterators.lines import lines
 from ..config.language import Language
 from .properties import Property
+from .reference_id import ReferenceId
+from .tangle_program import TangleProgram, compile_source
 
 
 def indent(prefix: str, text: str) -> str:
@@ -28,7 +31,7 @@ def indent(prefix: str, text: str) -> str:
     return "".join(map(indent_line, lines(text)))
 
 
-@dataclass
+@dataclass(slots=True)
 class CodeBlock:
     """
     Contains all distilled information on a codeblock.
@@ -50,6 +53,8 @@ class CodeBlock:
             file executable.
         namespace: The namespace of the markup file from which the code block
             was read.
+
+    The source is compiled into a `TangleProgram` on first use, see `program`.
     """
     properties: list[Property]
     indent: str
@@ -61,6 +66,55 @@ class CodeBlock:
     header: str | None = None
     mode: int | None = None
     namespace: tuple[str, ...] = ()
+    _program: tuple[str, tuple[str, ...], TangleProgram] | None = \
+        field(default=None, init=False, repr=False, compare=False)
+    _digest: tuple[tuple[object, ...], int, str] | None = \
+        field(default=None, init=False, repr=False, compare=False)
+    _source_digest: tuple[ReferenceId, str, str] | None = \
+        field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def program(self) -> TangleProgram:
+        """
+        The source compiled into a tangle program. The program is cached, and
+        only recompiled when `source` or `namespace` are replaced.
+        """
+        cached = self._program
+        if cached is None or cached[0] is not self.source or cached[1] is not self.namespace:
+            cached = (self.source, self.namespace, compile_source(self.source, self.namespace))
+            self._program = cached
+        return cached[2]
+
+    @property
+    def digest(self) -> str:
+        """
+        A digest of everything in this code block that determines its
+        tangled output: header, source, properties, language and namespace.
+        Like `program`, the digest is cached, and only computed again when
+        any of these are replaced or properties are added.
+        """
+        key = (self.source, self.namespace, self.header, self.language, self.properties)
+        cached = self._digest
+        if cached is not None and cached[1] == len(self.properties) \
+                and all(a is b for a, b in zip(cached[0], key)):
+            return cached[2]
+        comment = self.language.comment if self.language else None
+        parts = [
+            self.header or "", self.source, " ".join(map(str, self.properties)),
+            comment.open if comment else "", (comment and comment.close) or "",
+            "::".join(self.namespace)]
+        digest = hashlib.sha256("\0".join(parts).encode()).hexdigest()
+        self._digest = (key, len(self.properties), digest)
+        return digest
+
+    def source_digest(self, ref: ReferenceId) -> str:
+        """The digest of the source of this code block, see
+        `ReferenceId.source_digest`. This is cached like `digest`."""
+        cached = self._source_digest
+        if cached is None or cached[0] != ref or cached[1] is not self.source:
+            cached = (ref, self.source, ref.source_digest(self.source))
+            self._source_digest = cached
+        return cached[2]
 
     @property
     def text(self) -> str:
@@ -1,3 +1,6 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
 from dataclasses import dataclass
 from pathlib import PurePath
 from .code_block import CodeBlock
@@ -5,7 +8,7 @@ from .reference_id import ReferenceId
 from .reference_map import ReferenceMap
 
 
-@dataclass
+@dataclass(slots=True)
 class PlainText:
     content: str
 
@@ -32,3 +35,70 @@ def content_to_text(r: ReferenceMap, c: Content) -> tuple[str, PurePath | None]:
             code_block = r[c]
             return code_block.indented_text, code_block.origin.filename
 
+
+@dataclass(slots=True)
+class BlockSpan:
+    """
+    The position of a code block in the text of a markup file, together with
+    the parts of the code block that can change by stitching.
+    """
+    ref: ReferenceId
+    start: int
+    end: int
+    header: str | None
+    source: str
+
+
+@dataclass(slots=True)
+class SourceText:
+    """
+    The text of a markup file as it was reconstructed when loading, with the
+    spans of all its code blocks. Once code blocks are changed, `patch`
+    rebuilds the text by only replacing the spans of changed blocks.
+
+    Attributes:
+        text: the reconstructed text.
+        blocks: spans of code blocks, in order of appearance.
+        deps: markup files the text depends on.
+        verbatim: whether `text` is identical to the file it was read from.
+    """
+    text: str
+    blocks: list[BlockSpan]
+    deps: set[PurePath]
+    verbatim: bool = False
+
+    @staticmethod
+    def from_content(r: ReferenceMap, content: Iterable[Content]) -> SourceText:
+        parts: list[str] = []
+        blocks: list[BlockSpan] = []
+        deps: set[PurePath] = set()
+        pos = 0
+        for c in content:
+            t, d = content_to_text(r, c)
+            if isinstance(c, ReferenceId):
+                code_block = r[c]
+                blocks.append(BlockSpan(c, pos, pos + len(t), code_block.header, code_block.source))
+            if d is not None:
+                deps.add(d)
+            parts.append(t)
+            pos += len(t)
+        return SourceText("".join(parts), blocks, deps)
+
+    def patch(self, r: ReferenceMap) -> str | None:
+        """
+        Splice the current text of all changed code blocks into the text.
+        Returns `None` if no code block changed.
+        """
+        parts: list[str] = []
+        pos = 0
+        for span in self.blocks:
+            code_block = r[span.ref]
+            if code_block.source == span.source and code_block.header == span.header:
+                continue
+            parts.append(self.text[pos:span.start])
+            parts.append(code_block.indented_text)
+            pos = span.end
+        if not parts:
+            return None
+        parts.append(self.text[pos:])
+        return "".join(parts)
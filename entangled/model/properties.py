@@ -18,7 +18,7 @@ from ..parsing import (
 )
 
 
-@dataclass
+@dataclass(slots=True)
 class Id:
     value: str
 
@@ -30,7 +30,7 @@ class Id:
 id_p: Parser[Id] = cast(Parser[tuple[str]], matching(r"#([a-zA-Z]\S*)")) >> splat(Id)
 
 
-@dataclass
+@dataclass(slots=True)
 class Class:
     value: str
 
@@ -42,7 +42,7 @@ class Class:
 class_p: Parser[Class] = cast(Parser[tuple[str]], matching(r"\.?([a-zA-Z]\S*)")) >> splat(Class)
 
 
-@dataclass
+@dataclass(slots=True)
 class Attribute:
     key: str
     value: Any  # pyright: ignore[reportExplicitAny]
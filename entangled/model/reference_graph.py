@@ -0,0 +1,200 @@
+"""
+The reference graph has an edge from every reference name to each of the names
+that its code blocks refer to. It is used to find all cyclic and missing
+references up front, before any tangling is done.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import override
+
+from ..errors.user import UserError
+
+from .reference_map import ReferenceMap
+from .reference_name import ReferenceName
+from .tangle import CyclicReference, MissingReference
+from .tangle_program import Slot
+
+
+@dataclass
+class ReferenceErrors(UserError):
+    """Collects all errors found when checking references."""
+    errors: list[UserError]
+
+    @override
+    def __str__(self):
+        return "\n".join(str(e) for e in self.errors)
+
+
+@dataclass
+class ReferenceGraph:
+    """
+    Members:
+        `edges`: maps each reference name to the names it refers to, in order
+            of appearance and without duplicates.
+        `missing`: maps each reference name to the references it makes to
+            names that are not defined.
+    """
+    edges: dict[ReferenceName, list[ReferenceName]] = field(default_factory=dict)
+    missing: dict[ReferenceName, list[MissingReference]] = field(default_factory=dict)
+
+    @staticmethod
+    def from_map(refs: ReferenceMap) -> ReferenceGraph:
+        graph = ReferenceGraph()
+        for ref, code_block in refs.items():
+            targets = graph.edges.setdefault(ref.name, [])
+            for instruction in code_block.program:
+                if not isinstance(instruction, Slot):
+                    continue
+                if not refs.has_name(instruction.name):
+                    graph.missing.setdefault(ref.name, []).append(
+                        MissingReference(code_block.origin, instruction.name))
+                elif instruction.name not in targets:
+                    targets.append(instruction.name)
+        return graph
+
+    @cached_property
+    def reverse_edges(self) -> dict[ReferenceName, list[ReferenceName]]:
+        """Maps each reference name to the names that refer to it."""
+        result: dict[ReferenceName, list[ReferenceName]] = {}
+        for name, targets in self.edges.items():
+            for target in targets:
+                result.setdefault(target, []).append(name)
+        return result
+
+    def dependents(self, names: Iterable[ReferenceName]) -> set[ReferenceName]:
+        """Find all names that include any of the given names, directly or
+        transitively, including the given names themselves. This is the
+        reverse-dependency index: a target needs to be tangled again when
+        its root name is among the dependents of a changed name."""
+        result: set[ReferenceName] = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name in result:
+                continue
+            result.add(name)
+            stack.extend(n for n in self.reverse_edges.get(name, ()) if n not in result)
+        return result
+
+    def reachable(self, roots: Iterable[ReferenceName]) -> list[ReferenceName]:
+        """List all names that can be reached from the given roots, including
+        the roots themselves, in depth-first order."""
+        visited: dict[ReferenceName, None] = {}
+        stack = [r for r in reversed(list(roots)) if r in self.edges]
+        while stack:
+            name = stack.pop()
+            if name in visited:
+                continue
+            visited[name] = None
+            stack.extend(n for n in reversed(self.edges[name]) if n not in visited)
+        return list(visited)
+
+    def strongly_connected_components(self, roots: Iterable[ReferenceName]) -> list[list[ReferenceName]]:
+        """Tarjan's algorithm, restricted to the names reachable from `roots`.
+        This is implemented with an explicit stack, so that long chains of
+        references do not hit the recursion limit."""
+        index: dict[ReferenceName, int] = {}
+        lowlink: dict[ReferenceName, int] = {}
+        stack: list[ReferenceName] = []
+        on_stack: set[ReferenceName] = set()
+        result: list[list[ReferenceName]] = []
+
+        def push(name: ReferenceName):
+            index[name] = lowlink[name] = len(index)
+            stack.append(name)
+            on_stack.add(name)
+
+        for root in roots:
+            if root in index or root not in self.edges:
+                continue
+            push(root)
+            work: list[tuple[ReferenceName, int]] = [(root, 0)]
+            while work:
+                name, i = work[-1]
+                children = self.edges[name]
+                if i < len(children):
+                    work[-1] = (name, i + 1)
+                    child = children[i]
+                    if child not in index:
+                        push(child)
+                        work.append((child, 0))
+                    elif child in on_stack:
+                        lowlink[name] = min(lowlink[name], index[child])
+                    continue
+
+                _ = work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[name])
+                if lowlink[name] == index[name]:
+                    component: list[ReferenceName] = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    component.reverse()
+                    result.append(component)
+
+        return result
+
+    def find_cycle(self, component: list[ReferenceName]) -> list[ReferenceName]:
+        """Find a cycle through the first name of a strongly connected component."""
+        start = component[0]
+        members = set(component)
+        parent: dict[ReferenceName, ReferenceName] = {}
+        queue = [start]
+        for name in queue:
+            for child in self.edges[name]:
+                if child == start:
+                    path = [name]
+                    while path[-1] != start:
+                        path.append(parent[path[-1]])
+                    return path[::-1]
+                if child in members and child not in parent:
+                    parent[child] = name
+                    queue.append(child)
+        return []
+
+    def cycles(self, roots: Iterable[ReferenceName]) -> list[list[ReferenceName]]:
+        """List one cycle for every strongly connected component reachable from
+        `roots` that contains a cycle."""
+        return [self.find_cycle(c) for c in self.strongly_connected_components(roots)
+                if len(c) > 1 or c[0] in self.edges[c[0]]]
+
+    def errors(self, roots: Iterable[ReferenceName]) -> list[UserError]:
+        """Find all missing and cyclic references reachable from `roots`."""
+        roots = list(roots)
+        errors: list[UserError] = []
+        for name in self.reachable(roots):
+            errors.extend(self.missing.get(name, []))
+        for cycle in self.cycles(roots):
+            errors.append(CyclicReference(str(cycle[0]), [str(n) for n in cycle]))
+        return errors
+
+    def check(self, roots: Iterable[ReferenceName]):
+        """
+        Check that all references reachable from `roots` exist and contain no
+        cycles. After a successful check, these roots can be tangled with
+        `checked=True`.
+
+        Raises:
+            MissingReference, CyclicReference: if there is a single error.
+            ReferenceErrors: if there are several errors; all of them are reported.
+        """
+        errors = self.errors(roots)
+        if len(errors) == 1:
+            raise errors[0]
+        if errors:
+            raise ReferenceErrors(errors)
+
+
+def check_references(refs: ReferenceMap, roots: Iterable[ReferenceName]):
+    """Build the reference graph and check all references reachable from
+    `roots`, see `ReferenceGraph.check`."""
+    ReferenceGraph.from_map(refs).check(roots)
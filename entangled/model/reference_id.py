@@ -1,11 +1,14 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import PurePath
 from typing import override
 
+import hashlib
+
+from ..text_location import intern_filename
 from .reference_name import ReferenceName
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class ReferenceId:
     """
     The `ReferenceId` is the main key type into the `ReferenceMap`, and
@@ -20,12 +23,36 @@ class ReferenceId:
     name: ReferenceName
     file: PurePath
     ref_count: int
+    _hash: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        file = intern_filename(self.file)
+        object.__setattr__(self, "file", file)
+        object.__setattr__(self, "_hash", hash((self.name, file, self.ref_count)))
 
     @override
     def __hash__(self) -> int:
-        return hash((self.name, self.file, self.ref_count))
+        return self._hash
+
+    @override
+    def __reduce__(self):
+        # String hashes differ between processes, so never pickle `_hash`.
+        return (ReferenceId, (self.name, self.file, self.ref_count))
 
     @override
     def __str__(self) -> str:
         return f"{self.name}[{self.ref_count}]"
 
+    @property
+    def key(self) -> str:
+        """A string that identifies this reference, including its markup file."""
+        return f"{self.file.as_posix()}#{self}"
+
+    def source_digest(self, source: str) -> str:
+        """
+        A digest identifying this reference together with the given source.
+        The same digest can be computed from a code block in the markup and
+        from the annotated code it was tangled to, so it can be used to see
+        on which side a code block changed.
+        """
+        return hashlib.sha256(f"{self.key}\0{source}".encode()).hexdigest()
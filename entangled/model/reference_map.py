@@ -2,23 +2,35 @@ from collections import defaultdict
 from collections.abc import Iterable, Iterator, MutableMapping
 from dataclasses import dataclass, field
 from pathlib import PurePath
+
+import hashlib
 from typing import override
 
 
 from ..errors.internal import InternalError
 
 from .code_block import CodeBlock
-from .properties import get_attribute_string
+from .properties import Attribute, Class, get_attribute_string
 from .reference_id import ReferenceId
 from .reference_name import ReferenceName
 
 
-def length[T](seq: Iterable[T]) -> int:
-    """Compute the length of an iterable."""
-    i = 0
-    for _ in seq:
-        i += 1
-    return i
+def discard[K, V](index: dict[K, dict[V, None]], k: K, v: V):
+    """Remove `v` from the entry `k` of an index, removing the entry if
+    it becomes empty."""
+    if (entries := index.get(k)) is None:
+        return
+    _ = entries.pop(v, None)
+    if not entries:
+        del index[k]
+
+
+def move_to_end(entries: dict[ReferenceId, None], files: set[PurePath]):
+    """Move references from the given files to the end of an index entry,
+    keeping their order."""
+    for ref in [r for r in entries if r.file in files]:
+        del entries[ref]
+        entries[ref] = None
 
 
 @dataclass
@@ -30,17 +42,40 @@ class ReferenceMap(MutableMapping[ReferenceId, CodeBlock]):
         `targets`: lists filenames; a target should be in `index`
 
     The `ReferenceMap` implements `Mapping[ReferenceId, CodeBlock]`. In
-    addition to that, we keep an index on `ReferenceName`.
+    addition to that, we keep an index on `ReferenceName`, and secondary
+    indices on classes, attribute keys and markup source files. The secondary
+    indices are built from the properties of a code block at the moment it
+    is inserted into the map.
+
+    All indices are insertion ordered dictionaries, so that removing a
+    reference costs constant time, and removing all references from a
+    single markup file (see `replace_file`) scales with the number of
+    code blocks in that file.
     """
 
     _map: dict[ReferenceId, CodeBlock] = field(default_factory=dict)
-    _index: defaultdict[ReferenceName, list[ReferenceId]] \
-        = field(default_factory=lambda: defaultdict(list))
+    _index: defaultdict[ReferenceName, dict[ReferenceId, None]] \
+        = field(default_factory=lambda: defaultdict(dict))
+    _counts: dict[tuple[ReferenceName, PurePath], int] = field(default_factory=dict)
     _targets: dict[PurePath, ReferenceName] = field(default_factory=dict)
+    _targets_by_name: defaultdict[ReferenceName, set[PurePath]] \
+        = field(default_factory=lambda: defaultdict(set))
+    # The number of code blocks by a name with a `file` attribute for a target.
+    _file_attributes: dict[tuple[ReferenceName, PurePath], int] = field(default_factory=dict)
+    _by_class: defaultdict[str, dict[ReferenceId, None]] \
+        = field(default_factory=lambda: defaultdict(dict))
+    _by_attribute: defaultdict[str, dict[ReferenceId, None]] \
+        = field(default_factory=lambda: defaultdict(dict))
+    _by_file: defaultdict[PurePath, dict[ReferenceId, None]] \
+        = field(default_factory=lambda: defaultdict(dict))
 
     def select_by_name(self, name: ReferenceName) -> list[ReferenceId]:
         """Return a list of references with the same name."""
-        return self._index[name]
+        return list(self._index.get(name, ()))
+
+    def names(self) -> Iterable[ReferenceName]:
+        """Iterate all reference names in the map."""
+        return self._index.keys()
 
     def has_name(self, key: ReferenceName) -> bool:
         """Check that a name is present."""
@@ -49,18 +84,119 @@ class ReferenceMap(MutableMapping[ReferenceId, CodeBlock]):
     def new_id(self, filename: PurePath, name: ReferenceName) -> ReferenceId:
         """Create a new `ReferenceId` with a `ref_count` succeeding the last one
         by the same name."""
-        c = length(filter(lambda r: r.file == filename, self._index[name]))
-        return ReferenceId(name, filename, c)
+        return ReferenceId(name, filename, self._counts.get((name, filename), 0))
+
+    def name_digest(self, name: ReferenceName) -> str:
+        """A digest of all code blocks by the given name, in order. This
+        changes whenever the expansion of `name` itself changes, not counting
+        changes in the names it refers to."""
+        h = hashlib.sha256()
+        for ref in self._index.get(name, ()):
+            h.update(f"{ref.file.as_posix()}#{ref.ref_count}:{self._map[ref].digest}\n".encode())
+        return h.hexdigest()
 
     def select_by_target(self, target: PurePath) -> ReferenceName:
         return self._targets[target]
 
     def register_target(self, target: PurePath, ref_name: ReferenceName):
+        self.unregister_target(target)
         self._targets[target] = ref_name
+        self._targets_by_name[ref_name].add(target)
+
+    def unregister_target(self, target: PurePath):
+        if (ref_name := self._targets.pop(target, None)) is None:
+            return
+        targets = self._targets_by_name[ref_name]
+        targets.discard(target)
+        if not targets:
+            del self._targets_by_name[ref_name]
 
     def targets(self) -> Iterable[PurePath]:
         return self._targets.keys()
 
+    def by_class(self, class_name: str) -> list[ReferenceId]:
+        """Return references to code blocks that have the given class, in
+        order of insertion."""
+        return list(self._by_class.get(class_name, ()))
+
+    def by_attribute(self, key: str) -> list[ReferenceId]:
+        """Return references to code blocks that have an attribute with the
+        given key, in order of insertion."""
+        return list(self._by_attribute.get(key, ()))
+
+    def by_file(self, path: PurePath) -> list[ReferenceId]:
+        """Return references to code blocks that were read from the given
+        markup source file, in order of insertion."""
+        return list(self._by_file.get(path, ()))
+
+    def remove_file(self, path: PurePath) -> list[ReferenceId]:
+        """Remove all references that were read from the given markup source
+        file. Returns the removed references."""
+        removed = self.by_file(path)
+        for key in removed:
+            del self[key]
+        return removed
+
+    def replace_file(self, path: PurePath, blocks: Iterable[tuple[ReferenceId, CodeBlock]]):
+        """Replace all code blocks that were read from the given markup source
+        file with a new set of code blocks. This is used to re-ingest a single
+        edited file without rebuilding the entire map.
+
+        The order in which markup files were read is kept: where a name has
+        code blocks in several files, the new blocks take the place of the
+        old ones.
+
+        Args:
+            path: the markup source file.
+            blocks: the new references and code blocks, all having `path` for
+                their `file`, in order of appearance.
+        """
+        files = list(self._by_file)
+        later = set(files[files.index(path) + 1:]) if path in files else set()
+        _ = self.remove_file(path)
+        for key, value in blocks:
+            if key.file != path:
+                raise InternalError("Replacing code block from a different file", [key, path])
+            self[key] = value
+
+        if not later:
+            return
+        for key in self._by_file.get(path, ()):
+            move_to_end(self._index[key.name], later)
+            for p in self._map[key].properties:
+                match p:
+                    case Class(c):
+                        move_to_end(self._by_class[c], later)
+                    case Attribute(k, _):
+                        move_to_end(self._by_attribute[k], later)
+                    case _:
+                        pass
+        for f in files:
+            if f in later and f in self._by_file:
+                self._by_file[f] = self._by_file.pop(f)
+
+    def _add_to_indices(self, key: ReferenceId, value: CodeBlock):
+        self._by_file[key.file][key] = None
+        for p in value.properties:
+            match p:
+                case Class(c):
+                    self._by_class[c][key] = None
+                case Attribute(k, _):
+                    self._by_attribute[k][key] = None
+                case _:
+                    pass
+
+    def _remove_from_indices(self, key: ReferenceId, value: CodeBlock):
+        discard(self._by_file, key.file, key)
+        for p in value.properties:
+            match p:
+                case Class(c):
+                    discard(self._by_class, c, key)
+                case Attribute(k, _):
+                    discard(self._by_attribute, k, key)
+                case _:
+                    pass
+
     @override
     def __contains__(self, key: object) -> bool:
         return key in self._map
@@ -70,10 +206,16 @@ class ReferenceMap(MutableMapping[ReferenceId, CodeBlock]):
         if key in self._map:
             raise InternalError("Duplicate key in ReferenceMap", [key])
         self._map[key] = value
-        self._index[key.name].append(key)
+        self._index[key.name][key] = None
+        count_key = (key.name, key.file)
+        self._counts[count_key] = self._counts.get(count_key, 0) + 1
+        self._add_to_indices(key, value)
 
         if filename := get_attribute_string(value.properties, "file"):
-            self._targets[PurePath(filename)] = key.name
+            target = PurePath(filename)
+            self.register_target(target, key.name)
+            file_key = (key.name, target)
+            self._file_attributes[file_key] = self._file_attributes.get(file_key, 0) + 1
 
     @override
     def __getitem__(self, key: ReferenceId) -> CodeBlock:
@@ -84,11 +226,30 @@ class ReferenceMap(MutableMapping[ReferenceId, CodeBlock]):
         if key not in self:
             return
 
-        value = self._map[key]
+        value = self._map.pop(key)
+        discard(self._index, key.name, key)
+        count_key = (key.name, key.file)
+        if (count := self._counts[count_key] - 1):
+            self._counts[count_key] = count
+        else:
+            del self._counts[count_key]
+        self._remove_from_indices(key, value)
+
         if filename := get_attribute_string(value.properties, "file"):
-            del self._targets[PurePath(filename)]
-        self._index[key.name].remove(key)
-        del self._map[key]
+            target = PurePath(filename)
+            file_key = (key.name, target)
+            if (count := self._file_attributes[file_key] - 1):
+                self._file_attributes[file_key] = count
+            else:
+                del self._file_attributes[file_key]
+                if self._targets.get(target) == key.name:
+                    self.unregister_target(target)
+
+        if key.name not in self._index:
+            # Targets that refer to a name that no longer exists are dropped,
+            # this includes targets that were registered by hooks.
+            for target in list(self._targets_by_name.get(key.name, ())):
+                self.unregister_target(target)
 
     @override
     def __len__(self) -> int:
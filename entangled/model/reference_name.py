@@ -1,20 +1,58 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import override
 
+import sys
 
-@dataclass(frozen=True)
+
+_namespaces: dict[tuple[str, ...], tuple[str, ...]] = {}
+
+
+def intern_namespace(namespace: tuple[str, ...]) -> tuple[str, ...]:
+    """Return a canonical instance of a namespace tuple. Namespaces are shared
+    by many references, so interning them saves memory and speeds up
+    comparison."""
+    if (result := _namespaces.get(namespace)) is not None:
+        return result
+    result = tuple(sys.intern(s) for s in namespace)
+    _namespaces[result] = result
+    return result
+
+
+def clear_namespaces():
+    """Forget all interned namespaces. Long-running processes call this when
+    they read a document from scratch, so that the table doesn't keep
+    growing with namespaces that are no longer used."""
+    _namespaces.clear()
+
+
+@dataclass(frozen=True, slots=True)
 class ReferenceName:
     """
     Collects the concepts of a namespace and name into one object.
+
+    The hash is computed once on construction, since reference names are
+    used as dictionary keys in the inner loop of the tangler.
     """
     namespace: tuple[str, ...]
     name: str
+    _hash: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        namespace = intern_namespace(self.namespace)
+        object.__setattr__(self, "namespace", namespace)
+        object.__setattr__(self, "_hash", hash((namespace, self.name)))
 
     @override
     def __hash__(self) -> int:
-        return hash((*self.namespace, self.name))
+        return self._hash
+
+    @override
+    def __reduce__(self):
+        # String hashes differ between processes, so never pickle `_hash`.
+        return (ReferenceName, (self.namespace, self.name))
 
     @override
     def __str__(self):
@@ -24,6 +62,7 @@ class ReferenceName:
             return self.name
 
     @staticmethod
+    @lru_cache(maxsize=1 << 14)
     def from_str(name: str, namespace: tuple[str, ...] = ()) -> ReferenceName:
         path = name.split("::")
         if len(path) == 1:
@@ -1,29 +1,27 @@
-from collections.abc import Callable, Generator, Iterator
+from __future__ import annotations
+
+from collections import Counter
+from collections.abc import Iterable, Iterator
 from dataclasses import dataclass, field
-from contextlib import contextmanager
 from pathlib import PurePath
 
-import re
 from typing import override
 
 
 from ..config import AnnotationMethod
-from ..iterators.lines import lines
 from ..errors.user import UserError
 from ..text_location import TextLocation
 from ..logging import logger
 
+from .code_block import CodeBlock
 from .reference_map import ReferenceMap
 from .reference_id import ReferenceId
 from .reference_name import ReferenceName
+from .tangle_program import Slot, TangleProgram
 
 
 log = logger()
 
-# Pre-compiled regex for reference detection (e.g., "    <<refname>>")
-_REF_PATTERN = re.compile(r"^(?P<indent>\s*)<<(?P<refname>[\w:/_.-]+)>>\s*$")
-
-
 @dataclass
 class CyclicReference(UserError):
     ref_name: str
@@ -54,109 +52,300 @@ class MissingLanguageError(UserError):
         return f"{self.origin}: Missing language for code block."
 
 
-@dataclass
-class Visitor[T]:
-    _visited: dict[T, int] = field(default_factory=dict)
-
-    def in_order(self) -> list[T]:
-        return [k for k, _ in sorted(self._visited.items(), key=lambda kv: kv[1])]
-
-    @contextmanager
-    def visit(self, x: T):
-        if x in self._visited:
-            raise CyclicReference(str(x), [str(r) for r in self.in_order()])
-        self._visited[x] = len(self._visited)
-        yield
-        del self._visited[x]
-
-
 type Deps = set[PurePath]
-type Tangler = Callable[[Tangler, Deps, ReferenceId, bool, bool], Iterator[str]]
 
 
-def indent(prefix: str, g: Iterator[str]) -> Iterator[str]:
-    return map(lambda line: "" if not line else prefix + line, g)
-
-
-def naked_tangler(refs: ReferenceMap) -> Tangler:
-    visitor: Visitor[ReferenceId] = Visitor()
-
-    def tangler(
-        recur: Tangler, deps: set[PurePath], ref: ReferenceId, skip_header: bool, _: bool
-    ) -> Generator[str]:
-        code_block = refs[ref]
-        deps.add(code_block.origin.filename)
-
-        if code_block.header and not skip_header:
-            yield code_block.header
-
-        with visitor.visit(ref):
-            for line in lines(code_block.source):
-                if m := _REF_PATTERN.match(line.rstrip()):
-                    ref_name = ReferenceName.from_str(m["refname"], code_block.namespace)
-                    log.debug(f"tangling reference `{ref_name}`")
-                    if not refs.has_name(ref_name):
-                        raise MissingReference(code_block.origin, ref_name)
-                    ref_lst = refs.select_by_name(ref_name)
-                    yield from indent(m["indent"], recur(recur, deps, ref_lst[0], False, True))
-                    for ref in ref_lst[1:]:
-                        yield from indent(m["indent"], recur(recur, deps, ref, False, False))
-                else:
-                    yield line
-
-    return tangler
-
-
-def annotated_tangler(refs: ReferenceMap) -> Tangler:
-    naked = naked_tangler(refs)
-
-    def tangler(
-        recur: Tangler, deps: set[PurePath], ref: ReferenceId, skip_header: bool, first: bool
-    ) -> Generator[str]:
+@dataclass
+class TangleCache:
+    """
+    Expansions of references, shared between all targets in a single tangle.
+    Each entry stores the unindented lines of the expansion of a reference
+    name, together with the markup files it depends on, keyed on reference
+    name and annotation method. Since the first code block of a name is
+    always the `init` block, this also fixes the first-flag of the expansion.
+
+    If `shared` is given, only expansions of those names are stored. See
+    `for_roots`, which limits the cache to names that are needed more than
+    once, so that the expansions of large targets are not all kept in
+    memory until the tangle ends.
+
+    The cache must be discarded when the `ReferenceMap` changes.
+    """
+    _expansions: dict[tuple[ReferenceName, AnnotationMethod], tuple[list[str], frozenset[PurePath]]] \
+        = field(default_factory=dict)
+    shared: set[ReferenceName] | None = None
+
+    @staticmethod
+    def for_roots(refs: ReferenceMap, roots: Iterable[ReferenceName]) -> TangleCache:
+        """A cache for tangling `roots`, only storing the expansions of names
+        that are referenced more than once, counting the roots themselves."""
+        counts = Counter(roots)
+        todo = list(counts)
+        seen = set(todo)
+        while todo:
+            name = todo.pop()
+            for ref in refs.select_by_name(name):
+                for instruction in refs[ref].program:
+                    if not isinstance(instruction, Slot) or not refs.has_name(instruction.name):
+                        continue
+                    counts[instruction.name] += 1
+                    if instruction.name not in seen:
+                        seen.add(instruction.name)
+                        todo.append(instruction.name)
+        return TangleCache(shared={name for name, n in counts.items() if n > 1})
+
+    def wants(self, name: ReferenceName) -> bool:
+        """Whether the expansion of `name` should be stored."""
+        return self.shared is None or name in self.shared
+
+    def get(self, name: ReferenceName, annotation: AnnotationMethod) \
+            -> tuple[list[str], frozenset[PurePath]] | None:
+        return self._expansions.get((name, annotation))
+
+    def store(self, name: ReferenceName, annotation: AnnotationMethod,
+              lines: list[str], deps: frozenset[PurePath]):
+        if self.wants(name):
+            self._expansions[(name, annotation)] = (lines, deps)
+
+    def clear(self):
+        self._expansions.clear()
+
+
+@dataclass(slots=True)
+class Frame:
+    """
+    An expansion of a reference name on the tangler stack.
+
+    Attributes:
+        refs: the code blocks by this name.
+        index: the code block in `refs` that is being tangled.
+        code_block: the code block that is being tangled.
+        program: the compiled source of `code_block`.
+        cursor: the next instruction in `program`.
+        indent: indentation accumulated from all enclosing references.
+        start: position in the output where this expansion started.
+        deps: markup files that this expansion depends on.
+        close: the closing annotation comment for `code_block`.
+    """
+    refs: list[ReferenceId]
+    indent: str
+    start: int
+    deps: Deps
+    index: int = 0
+    code_block: CodeBlock | None = None
+    program: TangleProgram = ()
+    cursor: int = 0
+    close: str = ""
+
+
+def tangle_chunks(
+    refs: ReferenceMap,
+    name: ReferenceName,
+    annotation: AnnotationMethod,
+    deps: Deps,
+    cache: TangleCache | None = None,
+    checked: bool = False,
+    chunk_size: int | None = None,
+) -> Iterator[list[str]]:
+    """
+    Expand the code blocks by the given name into lists of output lines.
+    Nested references are expanded iteratively, using an explicit stack of
+    `Frame`, so that the depth of nesting is not limited by the recursion
+    limit, and every line is emitted into the output exactly once. Each code
+    block is run from its precompiled `TangleProgram`.
+
+    Without a `chunk_size`, all output is yielded as a single list. Otherwise,
+    the output is yielded in lists of about `chunk_size` lines, as soon as it
+    holds that many, except for lines of nested expansions that are still
+    being recorded for the `cache`. Once output is yielded, the expansion of
+    `name` itself is not stored in the `cache`.
+
+    The collected dependencies are added to `deps` once the output is
+    exhausted. If `checked` is set, the references were already validated by
+    `check_references`, and no bookkeeping is done to detect cyclic or
+    missing references.
+    """
+    annotated = annotation != AnnotationMethod.NAKED
+    flushed = False
+    out: list[str] = []
+    stack: list[Frame] = []
+    # Frames on the stack whose expansion is stored in the cache, outermost
+    # first. Their output can't be yielded until they are done.
+    recording: list[Frame] = []
+    # The set of code blocks on the stack, ordered by entry, for detecting cycles.
+    active: dict[ReferenceId, None] = {}
+
+    def emit(indent: str, line: str):
+        out.append(indent + line if line else "")
+
+    def begin_block(frame: Frame):
+        ref = frame.refs[frame.index]
         code_block = refs[ref]
-        if code_block.language is None:
-            raise MissingLanguageError(code_block.origin)
 
-        language = code_block.language
-        open_comment = language.comment.open
-        close_comment = (
-            "" if language.comment.close is None else f" {language.comment.close}"
-        )
-
-        if code_block.header and not skip_header:
-            yield code_block.header
-        ref_count_str = "init" if first else str(ref.ref_count)
-        yield f"{open_comment} ~/~ begin <<{ref.file.as_posix()}#{ref.name}>>[{ref_count_str}]{close_comment}\n"
-        yield from naked(recur, deps, ref, True, first)
-        yield f"{open_comment} ~/~ end{close_comment}\n"
-
-    return tangler
-
-
-tanglers = {
-    AnnotationMethod.NAKED: naked_tangler,
-    AnnotationMethod.STANDARD: annotated_tangler,
-    AnnotationMethod.SUPPLEMENTED: annotated_tangler,
-}
+        if annotated:
+            if code_block.language is None:
+                raise MissingLanguageError(code_block.origin)
+            comment = code_block.language.comment
+            close_comment = "" if comment.close is None else f" {comment.close}"
+
+            if code_block.header:
+                emit(frame.indent, code_block.header)
+            ref_count_str = "init" if frame.index == 0 else str(ref.ref_count)
+            emit(frame.indent, f"{comment.open} ~/~ begin <<{ref.file.as_posix()}#{ref.name}>>[{ref_count_str}]{close_comment}\n")
+            frame.close = f"{comment.open} ~/~ end{close_comment}\n"
+        elif code_block.header:
+            emit(frame.indent, code_block.header)
+
+        frame.deps.add(code_block.origin.filename)
+        if not checked:
+            if ref in active:
+                raise CyclicReference(str(ref), [str(r) for r in active])
+            active[ref] = None
+
+        frame.code_block = code_block
+        frame.program = code_block.program
+        frame.cursor = 0
+
+    def enter(name: ReferenceName, indent: str, parent_deps: Deps):
+        if cache is not None and (cached := cache.get(name, annotation)) is not None:
+            cached_lines, cached_deps = cached
+            parent_deps.update(cached_deps)
+            if indent:
+                out.extend(indent + line if line else "" for line in cached_lines)
+            else:
+                out.extend(cached_lines)
+            return
+
+        frame = Frame(refs.select_by_name(name), indent, len(out),
+                      parent_deps if cache is None else set())
+        if stack and cache is not None and cache.wants(name):
+            recording.append(frame)
+        stack.append(frame)
+        begin_block(frame)
+
+    def leave(frame: Frame):
+        if cache is None:
+            return
+        parent_deps = stack[-1].deps if stack else deps
+        parent_deps.update(frame.deps)
+        if recording and recording[-1] is frame:
+            _ = recording.pop()
+        if (flushed and not stack) or not cache.wants(frame.refs[0].name):
+            return
+        expanded = out[frame.start:]
+        if frame.indent:
+            n = len(frame.indent)
+            expanded = [line[n:] if line else "" for line in expanded]
+        cache.store(frame.refs[0].name, annotation, expanded, frozenset(frame.deps))
+
+    enter(name, "", deps)
+    while stack:
+        frame = stack[-1]
+        code_block = frame.code_block
+        assert code_block is not None
+
+        if frame.cursor == len(frame.program):
+            if not checked:
+                del active[frame.refs[frame.index]]
+            if annotated:
+                emit(frame.indent, frame.close)
+            frame.index += 1
+            if frame.index < len(frame.refs):
+                begin_block(frame)
+            else:
+                _ = stack.pop()
+                leave(frame)
+            continue
+
+        instruction = frame.program[frame.cursor]
+        frame.cursor += 1
+        if isinstance(instruction, Slot):
+            if not checked and not refs.has_name(instruction.name):
+                raise MissingReference(code_block.origin, instruction.name)
+            enter(instruction.name, frame.indent + instruction.indent, frame.deps)
+        elif frame.indent:
+            out.extend(frame.indent + line for line in instruction)
+        else:
+            out.extend(instruction)
+
+        if chunk_size is not None and len(out) >= chunk_size:
+            limit = recording[0].start if recording else len(out)
+            if limit >= chunk_size:
+                # A single code block can be longer than a chunk.
+                for i in range(0, limit, chunk_size):
+                    yield out[i:i + chunk_size]
+                del out[:limit]
+                for f in recording:
+                    f.start -= limit
+                flushed = True
+
+    yield out
+
+
+def tangle_lines(
+    refs: ReferenceMap,
+    name: ReferenceName,
+    annotation: AnnotationMethod,
+    deps: Deps,
+    cache: TangleCache | None = None,
+    checked: bool = False,
+) -> list[str]:
+    """
+    Expand the code blocks by the given name into a list of output lines,
+    see `tangle_chunks`.
+    """
+    (lines,) = tangle_chunks(refs, name, annotation, deps, cache, checked)
+    return lines
 
 
 def tangle_ref(
     refs: ReferenceMap,
     name: ReferenceName,
     annotation: AnnotationMethod = AnnotationMethod.STANDARD,
+    cache: TangleCache | None = None,
+    checked: bool = False,
 ) -> tuple[str, set[PurePath]]:
+    """
+    Tangle the code blocks by the given name.
+
+    Args:
+        refs: the reference map.
+        name: the reference name to expand.
+        annotation: the annotation method.
+        cache: when tangling many targets from the same reference map, pass
+            a `TangleCache` to expand shared references only once.
+        checked: set this when `name` was validated with `check_references`,
+            to skip detection of cyclic and missing references.
+
+    Returns:
+        The tangled text and the set of markup files it depends on.
+    """
     if not refs.has_name(name):
         raise KeyError(name)
-    tangler = tanglers[annotation](refs)
     deps: set[PurePath] = set()
 
-    def all_lines():
-        ref_lst = refs.select_by_name(name)
-        yield from tangler(tangler, deps, ref_lst[0], False, True)
-        for ref in ref_lst[1:]:
-            yield from tangler(tangler, deps, ref, False, False)
-
     # Use join for O(n) instead of O(n²) string concatenation
-    out = "".join(all_lines())
+    out = "".join(tangle_lines(refs, name, annotation, deps, cache, checked))
 
     return out, deps
+
+
+def tangle_stream(
+    refs: ReferenceMap,
+    name: ReferenceName,
+    annotation: AnnotationMethod = AnnotationMethod.STANDARD,
+    cache: TangleCache | None = None,
+    checked: bool = False,
+    chunk_size: int = 1 << 12,
+) -> tuple[Iterator[str], set[PurePath]]:
+    """
+    Tangle the code blocks by the given name, like `tangle_ref`, but produce
+    the text in chunks of about `chunk_size` lines, so that large outputs
+    never have to be held in memory as a whole. The returned set of markup
+    files is complete only once the chunks are exhausted.
+    """
+    if not refs.has_name(name):
+        raise KeyError(name)
+    deps: set[PurePath] = set()
+    chunks = tangle_chunks(refs, name, annotation, deps, cache, checked, chunk_size)
+    return map("".join, chunks), deps
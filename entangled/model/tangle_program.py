@@ -0,0 +1,61 @@
+"""
+Code blocks are compiled into a tangle program before tangling: a sequence of
+literal chunks of lines, interspersed with slots for references to other code
+blocks. Tangling then amounts to copying literal chunks and resolving slots,
+without running any regular expressions.
+"""
+
+from dataclasses import dataclass
+
+import re
+
+from ..iterators.lines import lines
+from .reference_name import ReferenceName
+
+
+# Pre-compiled regex for reference detection (e.g., "    <<refname>>")
+_REF_PATTERN = re.compile(r"^(?P<indent>\s*)<<(?P<refname>[\w:/_.-]+)>>\s*$")
+
+
+@dataclass(frozen=True, slots=True)
+class Slot:
+    """
+    A reference to other code blocks.
+
+    Attributes:
+        indent: The indentation of the reference.
+        name: The fully qualified name of the reference.
+    """
+    indent: str
+    name: ReferenceName
+
+
+type Literal = tuple[str, ...]
+type Instruction = Literal | Slot
+type TangleProgram = tuple[Instruction, ...]
+
+
+def compile_source(source: str, namespace: tuple[str, ...] = ()) -> TangleProgram:
+    """
+    Compile the source of a code block into a tangle program. Consecutive lines
+    without references are collected into a single literal chunk. References
+    are resolved with respect to the given namespace.
+    """
+    program: list[Instruction] = []
+    chunk: list[str] = []
+
+    for line in lines(source):
+        if not line:
+            continue
+        if m := _REF_PATTERN.match(line.rstrip()):
+            if chunk:
+                program.append(tuple(chunk))
+                chunk = []
+            program.append(Slot(m["indent"], ReferenceName.from_str(m["refname"], namespace)))
+        else:
+            chunk.append(line)
+
+    if chunk:
+        program.append(tuple(chunk))
+
+    return tuple(program)
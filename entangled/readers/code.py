@@ -1,5 +1,5 @@
 from collections.abc import Generator
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import PurePath
 
 import re
@@ -17,11 +17,20 @@ class Block:
     content: str
 
 
-# Pre-compile regex patterns at module level (avoid re-compilation on every call)
-_OPEN_BLOCK_PATTERN = re.compile(
-    r"^(?P<indent>\s*).* ~/~ begin <<(?P<source>[^#<>]+)#(?P<ref_name>[^#<>]+)>>\[(?P<ref_count>\d+|init)\]"
+# The annotation marker; lines without it are never matched against the
+# patterns below.
+_MARKER = "~/~"
+_BEGIN_PATTERN = re.compile(
+    r"~/~ begin <<(?P<source>[^#<>]+)#(?P<ref_name>[^#<>]+)>>\[(?P<ref_count>\d+|init)\]"
 )
-_CLOSE_BLOCK_PATTERN = re.compile(r"^(?P<indent>\s*).* ~/~ end")
+_END = "~/~ end"
+
+
+def _marker_indent(line: str, pos: int) -> str:
+    """The indentation of an annotation comment, when the marker is found at
+    `pos`: leading whitespace, not including the space before the marker."""
+    prefix = line[:pos - 1]
+    return prefix[:len(prefix) - len(prefix.lstrip())]
 
 
 @dataclass
@@ -32,14 +41,23 @@ class OpenBlockData:
 
 
 def open_block(line: str) -> OpenBlockData | None:
-    if not (m := _OPEN_BLOCK_PATTERN.match(line)):
-        return None
-
-    ref_name = ReferenceName.from_str(m["ref_name"])
-    md_source = PurePath(m["source"])
-    is_init = m["ref_count"] == "init"
-    ref_count = 0 if is_init else int(m["ref_count"])
-    return OpenBlockData(ReferenceId(ref_name, md_source, ref_count), is_init, m["indent"])
+    """
+    Match a line of the form `<indent><comment> ~/~ begin <<source#name>>[count]`.
+    Instead of matching a pattern against the entire line, the marker is
+    located with `str.rfind`, and only the part after the marker is matched.
+    If the marker occurs several times, the last matching one is used.
+    """
+    end = len(line)
+    while (pos := line.rfind(_MARKER, 0, end)) > 0:
+        end = pos + len(_MARKER) - 1
+        if line[pos - 1] == " " and (m := _BEGIN_PATTERN.match(line, pos)):
+            ref_name = ReferenceName.from_str(m["ref_name"])
+            md_source = PurePath(m["source"])
+            is_init = m["ref_count"] == "init"
+            ref_count = 0 if is_init else int(m["ref_count"])
+            return OpenBlockData(
+                ReferenceId(ref_name, md_source, ref_count), is_init, _marker_indent(line, pos))
+    return None
 
 
 @dataclass
@@ -48,9 +66,23 @@ class CloseBlockData:
 
 
 def close_block(line: str) -> CloseBlockData | None:
-    if not (m := _CLOSE_BLOCK_PATTERN.match(line)):
-        return None
-    return CloseBlockData(m["indent"])
+    """Match a line of the form `<indent><comment> ~/~ end`, see `open_block`."""
+    end = len(line)
+    while (pos := line.rfind(_END, 0, end)) > 0:
+        end = pos + len(_END) - 1
+        if line[pos - 1] == " ":
+            return CloseBlockData(_marker_indent(line, pos))
+    return None
+
+
+@dataclass
+class _Frame:
+    """A code block that is being read, with the namespace and indentation
+    of the code block that contains it."""
+    data: OpenBlockData
+    namespace: tuple[str, ...]
+    indent: str
+    content: list[str] = field(default_factory=list)
 
 
 def read_top_level(input: InputStream) -> Generator[Block]:
@@ -58,52 +90,77 @@ def read_top_level(input: InputStream) -> Generator[Block]:
         return
 
     while input:
-        r = yield from read_block((), "", input)
-        if r is None:
-            _ = next(input)
+        _, line = input.peek()
+        if _MARKER in line:
+            r = yield from read_block((), "", input)
+            if r is not None:
+                continue
+        _ = next(input)
 
 
 def read_block(namespace: tuple[str, ...], indent: str, input: InputStream) -> Generator[Block, None, str | None]:
+    """
+    Read a code block, if the input starts with one. Nested code blocks are
+    read iteratively, using an explicit stack. All code blocks are yielded
+    when they are closed, so inner blocks come before outer ones.
+
+    Returns:
+        `None` if the input doesn't start with a code block. Otherwise, the
+        text that replaces the code block in its parent: a reference if
+        this is the first code block of its name, or else an empty string.
+    """
     if not input:
         return None
 
-    pos, line1 = input.peek()
-    if (block_data := open_block(line1)) is None:
+    pos, line = input.peek()
+    if (block_data := open_block(line)) is None:
         return None
     _ = next(input)
 
-    log.debug(f"reading code block {block_data}")
+    stack: list[_Frame] = []
 
-    if block_data.indent < indent:
-        raise IndentationError(pos)
+    def push(frame: _Frame):
+        log.debug("reading code block %s", frame.data)
+        if frame.data.indent < frame.indent:
+            raise IndentationError(pos)
+        stack.append(frame)
 
-    # Use list for O(n) instead of O(n²) string concatenation
-    content_parts: list[str] = []
-    while input:
-        line = yield from read_block(block_data.ref.name.namespace, block_data.indent, input)
-        if line is not None:
-            content_parts.append(line)
-            continue
+    push(_Frame(block_data, namespace, indent))
+    while stack:
+        if not input:
+            raise ParseError(pos, "unexpected end of file")
 
+        top = stack[-1]
         pos, line = next(input)
-        if (close_block_data := close_block(line)) is None:
-            if not line.strip():
-                content_parts.append(line.lstrip(" \t"))
-            elif not line.startswith(block_data.indent):
-                raise IndentationError(pos)
-            else:
-                content_parts.append(line.removeprefix(block_data.indent))
+        if _MARKER in line:
+            if (block_data := open_block(line)) is not None:
+                push(_Frame(block_data, top.data.ref.name.namespace, top.data.indent))
+                continue
+
+            if (close_block_data := close_block(line)) is not None:
+                if close_block_data.indent != top.data.indent:
+                    raise IndentationError(pos)
+                _ = stack.pop()
+                yield Block(top.data.ref, "".join(top.content))
+
+                if top.data.is_init:
+                    extra_indent = top.data.indent.removeprefix(top.indent)
+                    ref = top.data.ref
+                    ref_str = ref.name.name if ref.name.namespace == top.namespace else str(ref.name)
+                    result = f"{extra_indent}<<{ref_str}>>\n"
+                else:
+                    result = ""
+
+                if not stack:
+                    return result
+                stack[-1].content.append(result)
+                continue
+
+        if not line.strip():
+            top.content.append(line.lstrip(" \t"))
+        elif not line.startswith(top.data.indent):
+            raise IndentationError(pos)
         else:
-            if close_block_data.indent != block_data.indent:
-                raise IndentationError(pos)
-            yield Block(block_data.ref, "".join(content_parts))
-
-            if block_data.is_init:
-                extra_indent = block_data.indent.removeprefix(indent)
-                ref = block_data.ref
-                ref_str = ref.name.name if ref.name.namespace == namespace else str(ref.name)
-                return f"{extra_indent}<<{ref_str}>>\n"
-            else:
-                return ""
-
-    raise ParseError(pos, "unexpected end of file")
+            top.content.append(line.removeprefix(top.data.indent))
+
+    return None
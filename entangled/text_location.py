@@ -3,7 +3,22 @@ from pathlib import PurePath
 from typing import override
 
 
-@dataclass
+_filenames: dict[PurePath, PurePath] = {}
+
+
+def intern_filename(filename: PurePath) -> PurePath:
+    """Return a canonical instance of a filename. The same handful of input
+    files is referenced by every line and code block read from them, so this
+    saves memory and reuses the hash cached by `PurePath`."""
+    return _filenames.setdefault(filename, filename)
+
+
+def clear_filenames():
+    """Forget all interned filenames, see `clear_namespaces`."""
+    _filenames.clear()
+
+
+@dataclass(slots=True)
 class TextLocation:
     """
     A dataclass to indicate the origin of a line. Because this is only used for
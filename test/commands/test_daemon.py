@@ -1,4 +1,5 @@
 from pathlib import Path
+import asyncio
 import time
 import os
 import threading
@@ -6,7 +7,11 @@ import pytest
 import sys
 
 from entangled.io.stat import stat
-from entangled.commands.watch import _watch
+from entangled.commands.sync import CommittedActions
+from entangled.commands.watch import _watch, SelfWrites, SyncScheduler, WatchFilter
+from entangled.io import transaction
+from entangled.io.transaction import TransactionMode
+from watchfiles import Change
 from entangled.logging import configure
 
 from contextlib import chdir
@@ -146,3 +151,139 @@ def test_daemon(tmp_path: Path):
             stop.set()
             t.join()
             time.sleep(0.1)
+
+
+def test_watch_filter(tmp_path: Path):
+    with chdir(tmp_path):
+        Path("entangled.toml").write_text(
+            'version = "2.4"\nwatch_list = ["src/**/*.md"]\nignore_list = ["**/draft-*.md"]\n')
+        with transaction() as t:
+            t.write(Path("out/hello.py"), "print('hello')", [])
+
+        watch_filter = WatchFilter()
+        assert watch_filter.refresh()
+        assert not watch_filter.refresh()
+
+        def relevant(path: str) -> bool:
+            return watch_filter(Change.modified, str(tmp_path / path))
+
+        assert relevant("src/doc.md")
+        assert relevant("src/sub/doc.md")
+        assert not relevant("src/draft-doc.md")
+        assert not relevant("README.md")
+        assert relevant("out/hello.py")
+        assert relevant("entangled.toml")
+        assert not relevant(".git/index")
+        assert not relevant(".entangled/filedb.json")
+        assert not relevant("src/.doc.md.swp")
+
+        with transaction() as t:
+            t.write(Path("out/goodbye.py"), "print('goodbye')", [])
+        assert watch_filter.refresh()
+        assert relevant("out/goodbye.py")
+
+        # `src` is watched recursively, others only if they contain inputs
+        # or targets, or are their parents
+        Path("src/sub").mkdir(parents=True)
+        Path("src/sub/doc.md").write_text("# hello\n")
+        Path("build").mkdir()
+        with transaction() as t:
+            t.update(Path("src/sub/doc.md"))
+        _ = watch_filter.refresh()
+        assert watch_filter.roots == {Path("src")}
+        assert watch_filter.dirs == {Path("."), Path("out")}
+
+        # new directories are watched, in case inputs appear in them
+        assert not watch_filter(Change.added, str(tmp_path / "lib"))
+        Path("lib").mkdir()
+        assert watch_filter(Change.added, str(tmp_path / "lib"))
+        assert watch_filter.refresh()
+        assert Path("lib") in watch_filter.dirs
+
+        Path("entangled.toml").write_text(
+            'version = "2.4"\nwatch_list = ["docs/*.md", "README.md"]\n')
+        assert watch_filter.refresh()
+        assert watch_filter.roots == set()
+        assert watch_filter.dirs == {Path("."), Path("docs"), Path("lib"), Path("out")}
+
+
+@pytest.mark.timeout(10)
+def test_new_input(tmp_path: Path):
+    """A new input file is noticed in a directory that had no inputs."""
+    with chdir(tmp_path):
+        Path("notes").mkdir()
+        Path("notes/todo.txt").write_text("nothing yet\n")
+        Path("main.md").write_text("``` {.python file=main.py}\nprint('main')\n```\n")
+        stop = threading.Event()
+        start = threading.Event()
+        t = threading.Thread(target=_watch, args=(stop, start))
+        try:
+            t.start()
+            start.wait()
+            assert wait_for_file("main.py")
+            # let the sync at startup pass
+            time.sleep(0.5)
+            Path("notes/new.md").write_text("``` {.python file=notes/new.py}\nprint('new')\n```\n")
+            assert wait_for_file("notes/new.py")
+        finally:
+            stop.set()
+            t.join()
+            time.sleep(0.1)
+
+
+def test_self_writes(tmp_path: Path):
+    with chdir(tmp_path):
+        self_writes = SelfWrites()
+        with transaction() as t:
+            t.write(Path("a.py"), "print('a')", [])
+            t.write(Path("b.py"), "print('b')", [])
+        self_writes.record(t.committed)
+
+        changes = {(Change.added, str(tmp_path / "a.py")), (Change.added, str(tmp_path / "b.py"))}
+        assert self_writes.filter(changes) == set()
+
+        # an edit after our own write is still seen
+        Path("b.py").write_text("print('B')")
+        assert self_writes.filter(changes) == {(Change.added, str(tmp_path / "b.py"))}
+
+        with transaction(TransactionMode.FORCE) as t:
+            t.keep(Path("b.py"))
+            t.clear_orphans()
+        self_writes.record(t.committed)
+        assert not Path("a.py").exists()
+        assert self_writes.filter({(Change.deleted, str(tmp_path / "a.py"))}) == set()
+
+        self_writes.ttl = 0.0
+        self_writes.record(t.committed)
+        assert self_writes.filter({(Change.deleted, str(tmp_path / "a.py"))}) != set()
+
+
+def test_sync_scheduler(tmp_path: Path):
+    results: list[bool] = []
+
+    class SlowResident:
+        committed = CommittedActions()
+
+        def sync(self, cancel: threading.Event):
+            time.sleep(0.2)
+            results.append(not cancel.is_set())
+            return results[-1]
+
+    async def run():
+        scheduler = SyncScheduler(SlowResident(), SelfWrites(), WatchFilter())
+        runner = asyncio.create_task(scheduler.run())
+        change = {(Change.modified, str(tmp_path / "a.md"))}
+        # a burst of changes costs one sync
+        for _ in range(5):
+            scheduler.changed(change)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        # changes during a sync cancel it, and cause one follow-up
+        scheduler.changed(change)
+        scheduler.changed(change)
+        await asyncio.sleep(0.6)
+        runner.cancel()
+
+    with chdir(tmp_path):
+        asyncio.run(run())
+    assert results == [False, True]
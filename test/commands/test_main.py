@@ -2,6 +2,7 @@ from entangled.commands import main
 from entangled.version import __version__
 
 import pytest
+import subprocess
 import sys
 import logging
 
@@ -23,3 +24,24 @@ def test_debug(caplog, tmpdir):
 
         assert "Welcome to Entangled" in caplog.text
 
+
+LAZY_IMPORTS = """
+import sys
+from entangled.commands import main
+try:
+    main(args=sys.argv[1:])
+except SystemExit:
+    pass
+heavy = ["repl_session", "brei", "copier", "watchfiles", "entangled.hooks.repl", "entangled.hooks.task"]
+print(" ".join(m for m in heavy if m in sys.modules))
+"""
+
+
+@pytest.mark.parametrize("args", [["--version"], ["status"]])
+def test_lazy_imports(tmp_path, args):
+    """Commands that should start fast don't import the REPL, the task
+    machinery or the watcher. This only checks which modules are imported;
+    it doesn't measure the startup time."""
+    result = subprocess.run([sys.executable, "-c", LAZY_IMPORTS, *args],
+                            cwd=tmp_path, capture_output=True, text=True, check=True)
+    assert result.stdout.splitlines()[-1] == ""
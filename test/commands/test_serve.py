@@ -0,0 +1,92 @@
+from contextlib import chdir
+from pathlib import Path
+import sys
+import threading
+
+import pytest
+
+from entangled.client import forward
+from entangled.commands.serve import Server
+from entangled.errors.user import HelpfulUserError
+
+if sys.platform.startswith("win"):
+    pytest.skip("Unix domain sockets are not available on Windows", allow_module_level=True)
+
+
+md = """
+``` {.python file=hello.py}
+print("hello")
+```
+""".lstrip()
+
+
+def test_serve(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    with chdir(tmp_path):
+        Path("main.md").write_text(md)
+        assert forward(["tangle"]) is None
+
+        server = Server()
+        with server.bind() as s:
+            t = threading.Thread(target=s.serve_forever)
+            t.start()
+            try:
+                assert forward(["--version"]) is None
+                assert forward(["tangle"]) == 0
+                assert Path("hello.py").exists()
+
+                Path("main.md").write_text(md.replace("hello", "goodbye"))
+                assert forward(["sync"]) == 0
+                assert 'print("goodbye")' in Path("goodbye.py").read_text()
+                assert not Path("hello.py").exists()
+                assert server.resident.doc is not None
+
+                _ = capsys.readouterr()
+                assert forward(["status"]) == 0
+                assert "goodbye.py" in capsys.readouterr().out
+
+                # tangle and stitch use the resident document as well
+                doc = server.resident.doc
+                Path("goodbye.py").write_text(Path("goodbye.py").read_text().replace('"goodbye"', '"ciao"'))
+                assert forward(["stitch"]) == 0
+                assert 'print("ciao")' in Path("main.md").read_text()
+                assert forward(["tangle"]) == 0
+                assert server.resident.doc is doc
+
+                assert forward(["tangle", "--bogus"]) == 2
+                assert "--bogus" in capsys.readouterr().out
+
+                with pytest.raises(Exception):
+                    _ = Server().bind()
+
+                assert Path(".entangled/server.sock").stat().st_mode & 0o777 == 0o600
+                assert server.run(["watch"]) == ("error: the Entangled server doesn't run `watch`\n", 2)
+                assert server.run([])[1] == 2
+            finally:
+                s.shutdown()
+                t.join()
+        # a stale socket is ignored, and replaced by a new server
+        assert Path(".entangled/server.sock").exists()
+        assert forward(["tangle"]) is None
+        with Server().bind():
+            pass
+
+
+def test_serve_errors(monkeypatch: pytest.MonkeyPatch):
+    """Errors are handled as they are by the command line."""
+    server = Server()
+
+    def helpful():
+        raise HelpfulUserError("no way", lambda: print("some help"))
+
+    monkeypatch.setattr(server.resident, "tangle", helpful)
+    output, code = server.run(["tangle"])
+    assert "some help" in output
+    assert code == -1
+
+    def bug():
+        raise RuntimeError("oops")
+
+    monkeypatch.setattr(server.resident, "tangle", bug)
+    output, code = server.run(["tangle"])
+    assert "RuntimeError: oops" in output
+    assert code == 1
@@ -0,0 +1,118 @@
+from contextlib import chdir
+from pathlib import Path
+
+from entangled.commands.sync import Action, ResidentDocument, run_sync, sync_action
+from entangled.interface import Document
+
+
+md = """
+``` {.python file=hello.py}
+<<greeting>>
+<<farewell>>
+```
+
+``` {.python #greeting}
+print("hello")
+```
+
+``` {.python #farewell}
+print("goodbye")
+```
+""".lstrip()
+
+
+def test_merge(tmp_path: Path):
+    with chdir(tmp_path):
+        Path("hello.md").write_text(md)
+        run_sync()
+        code = Path("hello.py").read_text()
+        assert 'print("goodbye")' in code
+
+        # different blocks changed on both sides
+        Path("hello.md").write_text(md.replace('"hello"', '"hi"'))
+        Path("hello.py").write_text(code.replace('"goodbye"', '"bye"'))
+        assert sync_action(Document()) == Action.MERGE
+        run_sync()
+        assert Path("hello.md").read_text() == md.replace('"hello"', '"hi"').replace('"goodbye"', '"bye"')
+        assert 'print("hi")' in Path("hello.py").read_text()
+        assert 'print("bye")' in Path("hello.py").read_text()
+        assert sync_action(Document()) == Action.NOTHING
+
+        # the same block changed on both sides
+        md2 = Path("hello.md").read_text()
+        code2 = Path("hello.py").read_text()
+        Path("hello.md").write_text(md2.replace('"hi"', '"hey"'))
+        Path("hello.py").write_text(code2.replace('"hi"', '"ho"'))
+        assert sync_action(Document()) == Action.NOTHING
+
+
+md_a = """
+``` {.python file=a.py}
+print("a")
+```
+""".lstrip()
+
+
+md_b = """
+``` {.python file=b.py}
+print("b")
+```
+""".lstrip()
+
+
+def test_resident_document(tmp_path: Path, monkeypatch):
+    reloaded: list[Path] = []
+    reload_source = Document.reload_source
+    monkeypatch.setattr(Document, "reload_source",
+                        lambda self, t, p: reloaded.append(p) or reload_source(self, t, p))
+
+    with chdir(tmp_path):
+        Path("a.md").write_text(md_a)
+        Path("b.md").write_text(md_b)
+        resident = ResidentDocument()
+        resident.sync()
+        doc = resident.doc
+        assert doc is not None
+        assert Path("a.py").exists() and Path("b.py").exists()
+
+        Path("b.md").write_text(md_b.replace('"b"', '"B"'))
+        resident.sync()
+        assert resident.doc is doc
+        assert reloaded == [Path("b.md")]
+        assert 'print("B")' in Path("b.py").read_text()
+
+        Path("a.py").write_text(Path("a.py").read_text().replace('"a"', '"A"'))
+        resident.sync()
+        assert resident.doc is doc
+        assert Path("a.md").read_text() == md_a.replace('"a"', '"A"')
+
+        Path("b.md").unlink()
+        resident.sync()
+        assert resident.doc is doc
+        assert not Path("b.py").exists()
+        assert Path("b.md") not in doc.content
+
+        Path("entangled.toml").write_text('version = "2.4"\n')
+        Path("a.md").write_text(md_a)
+        resident.sync()
+        assert resident.doc is not doc
+        assert 'print("a")' in Path("a.py").read_text()
+
+
+def test_resident_revert(tmp_path: Path):
+    """Markup that is reverted after a stitch is read again."""
+    with chdir(tmp_path):
+        Path("hello.md").write_text(md)
+        resident = ResidentDocument()
+        resident.sync()
+
+        code = Path("hello.py").read_text()
+        Path("hello.py").write_text(code.replace('"goodbye"', '"bye"'))
+        resident.sync()
+        assert 'print("bye")' in Path("hello.md").read_text()
+
+        Path("hello.md").write_text(md)
+        resident.sync()
+        assert 'print("goodbye")' in Path("hello.py").read_text()
+        assert 'print("bye")' not in Path("hello.py").read_text()
+        assert sync_action(Document()) == Action.NOTHING
@@ -0,0 +1,80 @@
+from importlib.metadata import EntryPoint
+from pathlib import Path
+import os
+import sys
+
+from entangled import hooks
+from entangled.hooks import discovery
+
+
+def install(site: Path, name: str, hooks: dict[str, str]):
+    dist_info = site / f"{name}-1.0.dist-info"
+    dist_info.mkdir()
+    _ = (dist_info / "METADATA").write_text(f"Metadata-Version: 2.1\nName: {name}\nVersion: 1.0\n")
+    entry_points = "".join(f"{k} = {v}\n" for k, v in hooks.items())
+    _ = (dist_info / "entry_points.txt").write_text(f"[entangled.hooks]\n{entry_points}")
+
+
+def test_discover_hooks(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    site = tmp_path / "site"
+    site.mkdir()
+    install(site, "shouting", {"shout": "entangled.hooks.shebang"})
+    monkeypatch.setattr(sys, "path", [str(site)])
+
+    scans: list[list[str]] = []
+    scan = discovery.scan
+
+    def counted_scan(path: list[str]) -> dict[str, str]:
+        scans.append(path)
+        return scan(path)
+
+    monkeypatch.setattr(discovery, "scan", counted_scan)
+
+    hooks = discovery.discover_hooks()
+    assert list(hooks) == ["shout"]
+    assert hooks["shout"].value == "entangled.hooks.shebang"
+    assert scans == [[str(site)]]
+
+    # the second time, the cache is used
+    assert discovery.discover_hooks() == hooks
+    assert len(scans) == 1
+    assert hooks["shout"].load().Hook.__name__ == "Hook"
+
+    # installing a package changes the environment
+    install(site, "whispering", {"whisper": "entangled.hooks.shebang"})
+    assert sorted(discovery.discover_hooks()) == ["shout", "whisper"]
+    assert len(scans) == 2
+
+    # a broken cache is ignored
+    discovery.cache_path().write_text("{")
+    assert len(discovery.discover_hooks()) == 2
+    assert len(scans) == 3
+    assert [p.name for p in discovery.cache_path().parent.iterdir()] == [discovery.cache_path().name]
+
+
+def test_environments(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    project = tmp_path / "project"
+    project.mkdir()
+    install(project, "local", {"local": "entangled.hooks.shebang"})
+    monkeypatch.chdir(project)
+
+    monkeypatch.setattr(sys, "path", ["", str(tmp_path / "a")])
+    path_a = discovery.cache_path()
+    # the current directory is not searched
+    assert discovery.discover_hooks() == {}
+
+    monkeypatch.setattr(sys, "path", ["", str(tmp_path / "b")])
+    assert discovery.cache_path() != path_a
+    assert discovery.discover_hooks() == {}
+    assert sorted(os.listdir(path_a.parent)) == sorted([path_a.name, discovery.cache_path().name])
+
+
+def test_external_overrides_builtin(monkeypatch):
+    monkeypatch.setattr(hooks, "discover_hooks", lambda: {
+        "shebang": EntryPoint("shebang", "entangled.hooks.spdx_license", discovery.GROUP)})
+    registry = hooks.HookRegistry({"shebang": ".shebang", "build": ".build"})
+    assert registry["shebang"].__module__ == "entangled.hooks.spdx_license"
+    assert registry["build"].__module__ == "entangled.hooks.build"
+    assert sorted(registry) == ["build", "shebang"]
@@ -0,0 +1,170 @@
+from pathlib import Path
+
+from entangled.io import VirtualFS, transaction
+from entangled.interface import Document, document
+from entangled.model import ReferenceGraph
+
+
+md_a = """
+``` {.python file=a.py}
+<<shared>>
+print("a")
+```
+""".lstrip()
+
+
+md_b = """
+``` {.python file=b.py}
+print("b")
+```
+
+``` {.python #shared}
+import sys
+```
+""".lstrip()
+
+
+def tangle(fs: VirtualFS) -> list[str]:
+    doc = Document()
+    with transaction(fs=fs) as t:
+        doc.load(t)
+        doc.tangle(t)
+        t.clear_orphans()
+        actions = [str(a) for a in t.actions]
+    return actions
+
+
+def test_incremental_tangle():
+    fs = VirtualFS.from_dict({"a.md": md_a, "b.md": md_b})
+    assert tangle(fs) == ["create `a.py`", "create `b.py`"]
+    assert tangle(fs) == []
+
+    fs.write(Path("a.md"), md_a.replace('"a"', '"A"'))
+    doc = Document()
+    with transaction(fs=fs) as t:
+        doc.load(t)
+        outdated = doc.outdated_targets(
+            t.db, ReferenceGraph.from_map(doc.reference_map), doc.reference_digests(), doc.config.annotation)
+    assert outdated == {Path("a.py")}
+    assert tangle(fs) == ["write `a.py`"]
+    assert 'print("A")' in fs[Path("a.py")].content
+
+    # a change in a shared reference affects all targets that include it
+    fs.write(Path("b.md"), md_b.replace("import sys", "import os"))
+    doc = Document()
+    with transaction(fs=fs) as t:
+        doc.load(t)
+        outdated = doc.outdated_targets(
+            t.db, ReferenceGraph.from_map(doc.reference_map), doc.reference_digests(), doc.config.annotation)
+    assert outdated == {Path("a.py")}
+    assert tangle(fs) == ["write `a.py`"]
+    assert "import os" in fs[Path("a.py")].content
+    assert Path("b.py") in fs
+
+
+def test_tangle_keys(monkeypatch):
+    fs = VirtualFS.from_dict({"a.md": md_a, "b.md": md_b})
+    assert tangle(fs) == ["create `a.py`", "create `b.py`"]
+
+    # without reference digests every target is outdated, but the keys
+    # of the targets still match, so nothing is tangled
+    with transaction(fs=fs) as t:
+        t.db.references = {}
+        assert set(t.db.tangle_keys) == {"a.py", "b.py"}
+
+    calls: list[object] = []
+    tangle_stream = document.tangle_stream
+    monkeypatch.setattr(document, "tangle_stream", lambda *args: calls.append(args[1]) or tangle_stream(*args))
+    assert tangle(fs) == []
+    assert calls == []
+
+    fs.write(Path("b.md"), md_b.replace("import sys", "import os"))
+    assert tangle(fs) == ["write `a.py`"]
+    assert [str(c) for c in calls] == ["a.py"]
+
+
+def test_stitch_changed_only(monkeypatch):
+    fs = VirtualFS.from_dict({"a.md": md_a, "b.md": md_b})
+    _ = tangle(fs)
+    fs.write(Path("b.py"), fs[Path("b.py")].content.replace('"b"', '"B"'))
+
+    loaded: list[Path] = []
+    load_code = Document.load_code
+    monkeypatch.setattr(Document, "load_code", lambda self, t, p: loaded.append(p) or load_code(self, t, p))
+
+    doc = Document()
+    with transaction(fs=fs) as t:
+        doc.load(t)
+        doc.load_all_code(t)
+        doc.stitch(t)
+    assert loaded == [Path("b.py")]
+    assert 'print("B")' in fs[Path("b.md")].content
+    assert fs[Path("a.md")].content == md_a
+
+
+def test_stitch_patch():
+    fs = VirtualFS.from_dict({"a.md": md_a, "b.md": md_b})
+    _ = tangle(fs)
+    fs.write(Path("b.py"), fs[Path("b.py")].content.replace('"b"', '"B"'))
+
+    doc = Document()
+    with transaction(fs=fs) as t:
+        doc.load(t)
+        doc.load_all_code(t)
+        doc.stitch(t)
+        assert [str(a) for a in t.actions] == ["write `b.md`"]
+        assert t.actions[0].content == doc.source_text(Path("b.md"))[0]
+    assert fs[Path("b.md")].content == md_b.replace('"b"', '"B"')
+
+
+md_long = """
+---
+title: long
+---
+
+``` {.python #a}
+a = 1
+```
+
+Some text.
+
+``` {.python #b}
+b = 1
+```
+
+``` {.python file=c.py}
+<<a>>
+<<b>>
+```
+""".lstrip()
+
+
+def test_reparse(monkeypatch):
+    reparsed: list[bool] = []
+    reparse = document.reparse
+    monkeypatch.setattr(document, "reparse", lambda *args: reparsed.append(r := reparse(*args)) or r)
+
+    fs = VirtualFS.from_dict({"a.md": md_long})
+    plain = Document()
+    with transaction(fs=fs) as t:
+        plain.load(t)
+    assert plain.source_texts == {}
+
+    doc = Document(keep_sources=True)
+    with transaction(fs=fs) as t:
+        doc.load(t)
+
+    # insert a block by an existing name in the middle
+    fs.write(Path("a.md"), md_long.replace("Some text.\n", "``` {.python #b}\nb = 0\n```\n"))
+    with transaction(fs=fs) as t:
+        doc.reload_source(t, Path("a.md"))
+    assert reparsed and reparsed[0] is not None
+
+    full = Document(keep_sources=True)
+    with transaction(fs=fs) as t:
+        full.load(t)
+    assert doc.content == full.content
+    assert doc.source_texts == full.source_texts
+    assert [(ref, cb.origin, cb.source) for ref, cb in doc.reference_map.items()] \
+        == [(ref, cb.origin, cb.source) for ref, cb in full.reference_map.items()]
+    assert doc.target_text(Path("c.py")) == full.target_text(Path("c.py"))
@@ -0,0 +1,109 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+import pytest
+
+from entangled.config import AnnotationMethod
+from entangled.io import VirtualFS, transaction
+from entangled.interface import Document
+from entangled.interface import parallel
+from entangled.model.tangle import MissingLanguageError
+
+
+def markdown(n: int) -> str:
+    blocks = ["``` {.python #shared}\nimport sys\n```\n"]
+    for i in range(n):
+        blocks.append(f"``` {{.python file=src/m{i}.py}}\n<<shared>>\nprint({i})\n```\n")
+    return "\n".join(blocks)
+
+
+def tangle(fs: VirtualFS, jobs: int) -> list[str]:
+    doc = Document()
+    with transaction(fs=fs) as t:
+        doc.load(t)
+        doc.tangle(t, jobs=jobs)
+        actions = [str(a) for a in t.actions]
+    return actions
+
+
+def test_parallel_tangle():
+    serial = VirtualFS.from_dict({"index.md": markdown(20)})
+    parallel = VirtualFS.from_dict({"index.md": markdown(20)})
+    actions = tangle(parallel, jobs=4)
+    assert actions == tangle(serial, jobs=1)
+    assert actions == [f"create `src/m{i}.py`" for i in range(20)]
+    for i in range(20):
+        path = Path(f"src/m{i}.py")
+        assert parallel[path].content == serial[path].content
+        assert f"print({i})" in parallel[path].content
+
+
+def test_parallel_tangle_error():
+    md = markdown(4) + "\n``` {file=src/x.txt}\nhello\n```\n"
+    fs = VirtualFS.from_dict({"index.md": md})
+    with pytest.raises(MissingLanguageError):
+        _ = tangle(fs, jobs=2)
+
+
+def test_parallel_tangle_threaded():
+    """With other threads running, processes are not forked."""
+    done = threading.Event()
+    t = threading.Thread(target=done.wait)
+    t.start()
+    try:
+        with parallel._executor(2) as pool:
+            assert isinstance(pool, ThreadPoolExecutor)
+        fs = VirtualFS.from_dict({"index.md": markdown(4)})
+        assert tangle(fs, jobs=2) == [f"create `src/m{i}.py`" for i in range(4)]
+    finally:
+        done.set()
+        t.join()
+
+
+def test_parallel_tangle_bug(monkeypatch: pytest.MonkeyPatch):
+    """Errors other than user errors in workers are not hidden by tangling
+    again in the main process."""
+    main = (os.getpid(), threading.get_ident())
+    tangle_ref = parallel.tangle_ref
+
+    def fail(*args, **kwargs):
+        if (os.getpid(), threading.get_ident()) != main:
+            raise RuntimeError("bug")
+        return tangle_ref(*args, **kwargs)
+
+    monkeypatch.setattr(parallel, "tangle_ref", fail)
+    fs = VirtualFS.from_dict({"index.md": markdown(4)})
+    with pytest.raises(RuntimeError, match="bug"):
+        _ = tangle(fs, jobs=2)
+
+
+def test_parallel_tangle_lazy(monkeypatch: pytest.MonkeyPatch):
+    """Results are yielded before all targets are tangled."""
+    fs = VirtualFS.from_dict({"index.md": markdown(4)})
+    doc = Document()
+    with transaction(fs=fs) as t:
+        doc.load(t)
+    names = [doc.reference_map.select_by_target(tgt) for tgt in doc.reference_map.targets()]
+
+    first_received = threading.Event()
+    tangle_ref = parallel.tangle_ref
+
+    def slow_last(refs, name, *args, **kwargs):
+        if name == names[-1]:
+            assert first_received.wait(5)
+        return tangle_ref(refs, name, *args, **kwargs)
+
+    monkeypatch.setattr(parallel, "tangle_ref", slow_last)
+    done = threading.Event()
+    t = threading.Thread(target=done.wait)
+    t.start()
+    try:
+        results = parallel.tangle_parallel(doc.reference_map, names, AnnotationMethod.STANDARD, 2)
+        assert "print(0)" in next(results)[0]
+        first_received.set()
+        assert len(list(results)) == 3
+    finally:
+        done.set()
+        t.join()
@@ -1,10 +1,14 @@
 from contextlib import chdir
 from pathlib import Path
+from threading import Event
 from time import sleep
 
-from entangled.io.transaction import Transaction, Create, Write, Delete
+import pytest
+
+from entangled.io.transaction import Transaction, TransactionCancelled, TransactionMode, Action, Create, Write, Delete, transaction
 from entangled.io.filedb import filedb
 from entangled.io.virtual import FileCache
+from entangled.io.stat import hexdigest
 
 
 def test_transaction(tmp_path: Path):
@@ -86,3 +90,90 @@ def test_changing_dependencies(tmp_path: Path):
             t.run()
 
         assert "from one only" in Path("output").read_text()
+
+
+def test_write_stream(tmp_path: Path):
+    with chdir(tmp_path):
+        tmp_dir = Path(".entangled/tmp")
+        chunks = ["hello\n", "", "world", "  \n\n"]
+
+        with transaction(TransactionMode.SHOW) as t:
+            t.write_stream(Path("a"), iter(chunks), [Path("src")])
+            assert isinstance(t.actions[0], Create)
+            assert t.actions[0].sources == [Path("src")]
+        assert not Path("a").exists()
+        assert list(tmp_dir.iterdir()) == []
+
+        with transaction() as t:
+            t.write_stream(Path("a"), iter(chunks), [])
+        assert Path("a").read_text() == "".join(chunks)
+        assert list(tmp_dir.iterdir()) == []
+
+        with filedb() as db:
+            assert db[Path("a")].hexdigest == hexdigest("hello\nworld")
+
+        with transaction() as t:
+            t.write_stream(Path("a"), iter(["hello\nworld\n"]), [])
+            assert t.actions == []
+        assert list(tmp_dir.iterdir()) == []
+
+
+def test_pipelined(tmp_path: Path):
+    with chdir(tmp_path):
+        with open("c", "w") as f:
+            _ = f.write("not managed")
+
+        with transaction(pipelined=True) as t:
+            t.write(Path("a"), "hello", [])
+            assert Path("a").exists()
+            assert t.actions == []
+            t.write_stream(Path("b"), iter(["goodbye"]), [])
+            assert Path("b").read_text() == "goodbye\n"
+            t.write(Path("c"), "overwrite", [])
+            assert isinstance(t.actions[0], Create)
+        # the conflicting write is held back, the others are committed
+        assert Path("c").read_text() == "not managed"
+
+        with filedb() as db:
+            assert Path("a") in db and Path("b") in db
+            assert Path("c") not in db
+
+        with transaction(TransactionMode.SHOW, pipelined=True) as t:
+            t.write(Path("d"), "shown", [])
+        assert not Path("d").exists()
+
+
+def test_cancel(tmp_path: Path):
+    with chdir(tmp_path):
+        cancel = Event()
+        committed: list[Action] = []
+        with pytest.raises(TransactionCancelled):
+            with transaction(pipelined=True, cancel=cancel, committed=committed) as t:
+                t.write(Path("a"), "hello", [])
+                cancel.set()
+                t.write(Path("b"), "goodbye", [])
+        assert [a.target for a in committed] == [Path("a")]
+        assert not Path("b").exists()
+
+        # the filedb knows about the files that were written
+        with filedb() as db:
+            assert Path("a") in db
+            assert Path("b") not in db
+
+
+def test_pipelined_error(tmp_path: Path):
+    with chdir(tmp_path):
+        with pytest.raises(RuntimeError):
+            with transaction(pipelined=True) as t:
+                t.write(Path("a"), "hello", [])
+                raise RuntimeError("hook failed")
+        assert Path("a").exists()
+
+        # the filedb knows about the file that was written
+        with filedb() as db:
+            assert Path("a") in db
+
+        with transaction() as t:
+            t.write(Path("a"), "goodbye", [])
+            assert t.all_ok()
+        assert Path("a").read_text() == "goodbye\n"
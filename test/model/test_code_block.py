@@ -1,6 +1,9 @@
 from pathlib import PurePath
 from textwrap import indent
 from entangled.model.code_block import CodeBlock
+from entangled.model.properties import Class
+from entangled.model.reference_id import ReferenceId
+from entangled.model.reference_name import ReferenceName
 from entangled.text_location import TextLocation
 
 eol = "\n"
@@ -50,3 +53,31 @@ def test_code_block():
     assert cb.indented_text == expected_3
 
 
+
+
+def test_code_block_digest():
+    cb = CodeBlock(
+        properties=[],
+        open_line=f"```{eol}",
+        close_line=f"```{eol}",
+        source=f"hello{eol}",
+        indent="",
+        origin=TextLocation(PurePath("-"), 1)
+    )
+    ref = ReferenceId(ReferenceName((), "hello"), PurePath("-"), 0)
+    digest = cb.digest
+    assert cb.digest is digest
+    assert cb.source_digest(ref) == ref.source_digest(cb.source)
+    assert cb.source_digest(ref) is cb.source_digest(ref)
+
+    cb.source = f"goodbye{eol}"
+    assert cb.digest != digest
+    assert cb.source_digest(ref) == ref.source_digest(cb.source)
+
+    digest = cb.digest
+    cb.properties.append(Class("python"))
+    assert cb.digest != digest
+
+    digest = cb.digest
+    cb.header = f"#!/bin/sh{eol}"
+    assert cb.digest != digest
@@ -1,6 +1,6 @@
 from entangled.text_location import TextLocation
 from entangled.model import ReferenceMap, ReferenceId, ReferenceName, CodeBlock
-from entangled.model.content import PlainText, content_to_text
+from entangled.model.content import PlainText, SourceText, content_to_text
 
 from pathlib import PurePath
 
@@ -13,3 +13,19 @@ def test_content_to_text():
     assert content_to_text(refs, ref)[0] == "x"
     assert content_to_text(refs, PlainText("y"))[0] == "y"
 
+
+def test_source_text_patch():
+    refs = ReferenceMap()
+    content = []
+    for i, name in enumerate(["a", "b"]):
+        ref = ReferenceId(ReferenceName((), name), PurePath("a.md"), 0)
+        refs[ref] = CodeBlock(properties=[], indent="  ", open_line="```\n", source=f"{name}\n",
+                              close_line="```\n", origin=TextLocation(PurePath("a.md"), i))
+        content += [PlainText(f"text {name}\n"), ref]
+
+    source = SourceText.from_content(refs, content)
+    assert source.text == "text a\n  ```\n  a\n  ```\ntext b\n  ```\n  b\n  ```\n"
+    assert source.patch(refs) is None
+
+    refs[content[3]].source = "b\nc\n"
+    assert source.patch(refs) == "".join(content_to_text(refs, c)[0] for c in content)
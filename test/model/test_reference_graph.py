@@ -0,0 +1,71 @@
+import pytest
+
+from entangled.interface import Document
+from entangled.io import VirtualFS, transaction
+from entangled.model import ReferenceName, ReferenceGraph, check_references
+from entangled.model.reference_graph import ReferenceErrors
+from entangled.model.tangle import CyclicReference, MissingReference
+
+from pathlib import Path
+
+
+fs = VirtualFS.from_dict({
+    "input.md": """
+``` {.python #hello}
+<<hello>>
+```
+
+``` {.python #phobos}
+<<deimos>>
+```
+
+``` {.python #deimos}
+<<phobos>>
+```
+
+``` {.python #mars}
+<<phobos>>
+<<moon>>
+```
+
+``` {.python #helium}
+<<electron>>
+<<electron>>
+```
+
+``` {.python #electron}
+negative charge
+```
+"""})
+
+
+def name(n: str) -> ReferenceName:
+    return ReferenceName((), n)
+
+
+def test_reference_graph():
+    doc = Document()
+    with transaction(fs=fs) as t:
+        doc.load_source(t, Path("input.md"))
+    refs = doc.reference_map
+    graph = ReferenceGraph.from_map(refs)
+
+    assert graph.edges[name("helium")] == [name("electron")]
+    assert graph.reachable([name("mars")]) == [name("mars"), name("phobos"), name("deimos")]
+    assert graph.cycles([name("helium")]) == []
+    assert graph.cycles([name("hello")]) == [[name("hello")]]
+    assert graph.cycles([name("mars")]) == [[name("phobos"), name("deimos")]]
+
+    check_references(refs, [name("helium")])
+
+    with pytest.raises(CyclicReference):
+        check_references(refs, [name("hello")])
+
+    with pytest.raises(ReferenceErrors) as exc:
+        check_references(refs, [name("mars"), name("hello"), name("helium")])
+    errors = exc.value.errors
+    assert len(errors) == 3
+    assert isinstance(errors[0], MissingReference)
+    assert errors[0].ref_name == name("moon")
+    assert all(isinstance(e, CyclicReference) for e in errors[1:])
+    assert "deimos" in str(exc.value) and "hello" in str(exc.value)
@@ -2,7 +2,7 @@ from entangled.model import CodeBlock, ReferenceName, ReferenceMap, Property, At
 from entangled.model.reference_map import ReferenceMap
 from entangled.text_location import TextLocation
 from entangled.errors.internal import InternalError
-from entangled.model.properties import Attribute
+from entangled.model.properties import Attribute, Class
 
 from pathlib import PurePath
 
@@ -55,3 +55,76 @@ def test_reference_map():
     assert len(refs) == 3
     assert r4 not in refs 
 
+
+
+def test_secondary_indices():
+    refs = ReferenceMap()
+    r1 = refs.new_id(PurePath("x.md"), ref("a"))
+    refs[r1] = mock_code_block([Class("python"), Class("task"), Attribute("creates", "out.txt")])
+    r2 = refs.new_id(PurePath("y.md"), ref("b"))
+    refs[r2] = mock_code_block([Class("python"), Attribute("file", "b.py")])
+    r3 = refs.new_id(PurePath("x.md"), ref("c"))
+    refs[r3] = mock_code_block([Class("task")])
+
+    assert refs.by_class("task") == [r1, r3]
+    assert refs.by_class("python") == [r1, r2]
+    assert refs.by_class("build") == []
+    assert refs.by_attribute("file") == [r2]
+    assert refs.by_attribute("creates") == [r1]
+    assert refs.by_file(PurePath("x.md")) == [r1, r3]
+    assert refs.by_file(PurePath("y.md")) == [r2]
+
+    del refs[r1]
+    assert refs.by_class("task") == [r3]
+    assert refs.by_attribute("creates") == []
+    assert refs.by_file(PurePath("x.md")) == [r3]
+
+
+def test_replace_file():
+    refs = ReferenceMap()
+    x, y = PurePath("x.md"), PurePath("y.md")
+    for filename in [x, y, x]:
+        r = refs.new_id(filename, ref("a"))
+        refs[r] = mock_code_block()
+    r_main = refs.new_id(x, ref("main.py"))
+    refs[r_main] = mock_code_block([Attribute("file", "main.py")])
+    refs.register_target(PurePath("build.sh"), ref("a"))
+
+    assert [r.ref_count for r in refs.select_by_name(ref("a"))] == [0, 0, 1]
+    assert sorted(refs.targets()) == [PurePath("build.sh"), PurePath("main.py")]
+
+    scratch = ReferenceMap()
+    r_new = scratch.new_id(x, ref("a"))
+    scratch[r_new] = mock_code_block()
+    refs.replace_file(x, scratch.items())
+
+    assert refs.by_file(x) == [r_new]
+    # `x.md` was read before `y.md`, so its blocks still come first
+    assert [r.file for r in refs.select_by_name(ref("a"))] == [x, y]
+    assert refs.new_id(x, ref("a")).ref_count == 1
+    assert not refs.has_name(ref("main.py"))
+    assert list(refs.targets()) == [PurePath("build.sh")]
+
+    assert refs.remove_file(x) == [r_new]
+    assert refs.remove_file(y) != []
+    assert not refs
+    assert list(refs.targets()) == []
+    assert refs.new_id(x, ref("a")).ref_count == 0
+
+
+def test_file_attribute_count():
+    refs = ReferenceMap()
+    x, y = PurePath("x.md"), PurePath("y.md")
+    r1 = refs.new_id(x, ref("main"))
+    refs[r1] = mock_code_block([Attribute("file", "main.py")])
+    r2 = refs.new_id(y, ref("main"))
+    refs[r2] = mock_code_block([Attribute("file", "main.py")])
+    r3 = refs.new_id(y, ref("main"))
+    refs[r3] = mock_code_block()
+
+    # the target stays as long as a block by that name claims it
+    _ = refs.remove_file(x)
+    assert list(refs.targets()) == [PurePath("main.py")]
+    del refs[r2]
+    assert refs.has_name(ref("main"))
+    assert list(refs.targets()) == []
@@ -1,4 +1,6 @@
-from entangled.model.reference_name import ReferenceName
+import pickle
+
+from entangled.model.reference_name import ReferenceName, clear_namespaces
 
 
 def test_reference_name():
@@ -14,3 +16,26 @@ def test_reference_name():
 
     assert hash(n1) != hash(n2)
 
+
+def test_reference_name_compact():
+    n1 = ReferenceName.from_str("x::y::z")
+    n2 = ReferenceName(("x", "y"), "z")
+    assert n1 == n2
+    assert hash(n1) == hash(n2)
+    assert n1.namespace is n2.namespace
+    assert ReferenceName.from_str("x::y::z") is n1
+    assert not hasattr(n1, "__dict__")
+
+    n3 = pickle.loads(pickle.dumps(n1))
+    assert n3 == n1
+    assert hash(n3) == hash(n1)
+    assert repr(n3) == "ReferenceName(namespace=('x', 'y'), name='z')"
+
+
+def test_clear_namespaces():
+    n1 = ReferenceName(("p", "q"), "r")
+    clear_namespaces()
+    n2 = ReferenceName(("p", "q"), "r")
+    assert n1 == n2
+    assert hash(n1) == hash(n2)
+    assert ReferenceName(("p", "q"), "s").namespace is n2.namespace
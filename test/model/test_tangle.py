@@ -1,6 +1,6 @@
 from entangled.config import Config, AnnotationMethod
 from entangled.readers import run_reader
-from entangled.model import ReferenceMap, ReferenceName, ReferenceId, tangle_ref
+from entangled.model import ReferenceMap, ReferenceName, ReferenceId, TangleCache, tangle_ref, tangle_stream
 from entangled.model.tangle import MissingLanguageError, MissingReference
 from entangled.interface import Context, markdown
 
@@ -8,6 +8,7 @@ from pathlib import PurePath
 from functools import partial
 
 import pytest
+import sys
 import textwrap
 
 
@@ -133,3 +134,88 @@ def test_absent_ref():
         _ = tangle_ref(refs, ReferenceName((), "e"))
 
     assert "not-here" in str(exc.value)
+
+
+@pytest.mark.parametrize("annotation", list(AnnotationMethod))
+def test_tangle_cache(annotation: AnnotationMethod):
+    refs = ReferenceMap()
+    _ = run_reader(partial(markdown, Context(), refs), input1_md)
+    cache = TangleCache()
+    names = [ReferenceName((), n) for n in ["main", "g", "f", "f-condition", "f"]]
+
+    for name in names:
+        assert tangle_ref(refs, name, annotation, cache) == tangle_ref(refs, name, annotation)
+
+    assert cache.get(ReferenceName((), "g"), annotation) is not None
+    assert cache.get(ReferenceName((), "f-base-case"), annotation) is not None
+    assert cache.get(ReferenceName((), "e"), annotation) is None
+
+
+def test_tangle_cache_shared():
+    refs = ReferenceMap()
+    _ = run_reader(partial(markdown, Context(), refs), input1_md)
+    names = [ReferenceName((), n) for n in ["main", "g", "f"]]
+    cache = TangleCache.for_roots(refs, names)
+    assert cache.shared == {ReferenceName((), "g")}
+
+    for name in names:
+        assert tangle_ref(refs, name, AnnotationMethod.STANDARD, cache) \
+            == tangle_ref(refs, name, AnnotationMethod.STANDARD)
+
+    assert cache.get(ReferenceName((), "g"), AnnotationMethod.STANDARD) is not None
+    assert cache.get(ReferenceName((), "f-condition"), AnnotationMethod.STANDARD) is None
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_tangle_stream_nested(shared: bool):
+    """A large expansion nested in a target is streamed, unless it is
+    recorded for the cache."""
+    table = "".join(f"row{i}\n" for i in range(1000))
+    input_md = f"``` {{.python file=table.py}}\n# header\n<<table>>\n```\n\n" \
+        f"``` {{.python #table}}\n{table}```\n"
+    refs = ReferenceMap()
+    _ = run_reader(partial(markdown, Context(), refs), input_md)
+    root = ReferenceName((), "table.py")
+    names = [root, ReferenceName((), "table")] if shared else [root]
+    cache = TangleCache.for_roots(refs, names)
+
+    chunks, _ = tangle_stream(refs, root, AnnotationMethod.NAKED, cache, chunk_size=100)
+    text = list(chunks)
+    assert "".join(text) == tangle_ref(refs, root, AnnotationMethod.NAKED)[0]
+    if shared:
+        assert cache.get(ReferenceName((), "table"), AnnotationMethod.NAKED) is not None
+        assert len(text) <= 2
+    else:
+        assert len(text) >= 10
+        assert all(chunk.count("\n") < 200 for chunk in text)
+
+
+def test_deep_nesting():
+    depth = 2 * sys.getrecursionlimit()
+    input_md = "".join(
+        f"``` {{.python #n{i}}}\n <<n{i + 1}>>\n```\n\n" for i in range(depth)
+    ) + f"``` {{.python #n{depth}}}\nbottom\n```\n"
+    refs = ReferenceMap()
+    _ = run_reader(partial(markdown, Context(), refs), input_md)
+
+    naked, _ = tangle_ref(refs, ReferenceName((), "n0"), AnnotationMethod.NAKED)
+    assert naked == " " * depth + "bottom\n"
+    annotated, _ = tangle_ref(refs, ReferenceName((), "n0"), AnnotationMethod.STANDARD)
+    assert annotated.count("~/~ begin") == depth + 1
+
+
+@pytest.mark.parametrize("annotation", list(AnnotationMethod))
+def test_tangle_stream(annotation: AnnotationMethod):
+    refs = ReferenceMap()
+    _ = run_reader(partial(markdown, Context(), refs), input1_md)
+    cache = TangleCache()
+
+    for name in [ReferenceName((), n) for n in ["g", "main", "f", "main"]]:
+        chunks, deps = tangle_stream(refs, name, annotation, cache, chunk_size=1)
+        text = list(chunks)
+        assert "".join(text) == tangle_ref(refs, name, annotation)[0]
+        assert deps == tangle_ref(refs, name, annotation)[1]
+
+    # three blocks at the top level, so at least three chunks
+    chunks, _ = tangle_stream(refs, ReferenceName((), "g"), annotation, chunk_size=1)
+    assert len(list(chunks)) >= 3
@@ -0,0 +1,32 @@
+from entangled.model import CodeBlock, ReferenceName
+from entangled.model.tangle_program import Slot, compile_source
+from entangled.text_location import TextLocation
+
+from pathlib import PurePath
+
+
+source = """
+def f():
+    <<body>>
+    <<ns::other>>  
+
+return f
+""".lstrip()
+
+
+def test_compile_source():
+    program = compile_source(source, ("a.md",))
+    assert program == (
+        ("def f():\n",),
+        Slot("    ", ReferenceName(("a.md",), "body")),
+        Slot("    ", ReferenceName(("ns",), "other")),
+        ("\n", "return f\n"),
+    )
+
+
+def test_program_cache():
+    cb = CodeBlock([], "", "", "", source, TextLocation(PurePath("a.md")))
+    program = cb.program
+    assert cb.program is program
+    cb.source = "<<body>>\n"
+    assert cb.program == (Slot("", ReferenceName((), "body")),)
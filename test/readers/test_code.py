@@ -7,6 +7,7 @@ from entangled.errors.user import IndentationError, ParseError
 from entangled.iterators import run_generator, Peekable
 
 import pytest
+import sys
 
 
 hs_tgt_annotated = """
@@ -140,3 +141,13 @@ This is an error
 def test_eof():
     with pytest.raises(ParseError):
         _ = run_reader(read_top_level, eof_error)
+
+
+def test_deep_nesting():
+    depth = 2 * sys.getrecursionlimit()
+    code = "".join(f"# ~/~ begin <<a.md#n{i}>>[init]\n" for i in range(depth)) \
+        + "bottom\n" + "# ~/~ end\n" * depth
+    blocks, _ = run_reader(read_top_level, code)
+    assert len(blocks) == depth
+    assert blocks[0].content == "bottom\n"
+    assert blocks[-1].content == "<<n1>>\n"